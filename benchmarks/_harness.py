@@ -0,0 +1,128 @@
+"""Shared helpers for the local benchmarks.
+
+The handlers live in hyphenated directories, so they are loaded by path with a
+dummy region/credentials set (their AWS clients are built on first use).
+The stub clients below stand in for S3/DynamoDB and sleep for a configurable
+latency on every call so round trips can be measured without AWS.
+"""
+import importlib.util
+import io
+import os
+import statistics
+import sys
+import threading
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HANDLERS = {
+    "proxy": "og-proxy-integration/DTTLambdaProxyIntegration.py",
+    "homefeed": "homefeed-handler/dttHomefeedHandler.py",
+    "processing": "video-processing-center/DTTProcessingCenter.py",
+    "signin": "google-token-verification-docker-for-lambda/lambda_function.py",
+}
+
+
+def loadHandler(name):
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-1")
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    path = os.path.join(REPO_ROOT, HANDLERS[name])
+    spec = importlib.util.spec_from_file_location("bench_" + name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class StubS3:
+    """get_object/generate_presigned_url stand-in with injected latency."""
+
+    def __init__(self, objects, latency=0.02):
+        self.objects = objects
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def get_object(self, Bucket, Key, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": '"{}"'.format(hash(Key))}
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        return "https://{}.s3.amazonaws.com/{}?X-Amz-Expires={}".format(Params["Bucket"], Params["Key"], ExpiresIn)
+
+
+def timeIt(fn, repeat=5):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def _conditionValues(condition):
+    """Flatten a boto3 Key condition into {attribute: (operator, value)}."""
+    expression = condition.get_expression()
+    if expression["operator"] == "AND":
+        values = {}
+        for part in expression["values"]:
+            values.update(_conditionValues(part))
+        return values
+    key, value = expression["values"]
+    return {key.name: (expression["operator"], value)}
+
+
+class StubVideosTable:
+    """Newest-first query over dothethingvideos-metadata style items, with latency.
+
+    Only the access patterns the feed handlers use are supported: equality on the
+    partition attribute, an optional <= on timeOfCreation, Limit, ExclusiveStartKey
+    and Select=COUNT. Homefeed entries (dtt_common.homefeed_index) sort the same way.
+    """
+
+    def __init__(self, items, partition="code", latency=0.01):
+        self.partition = partition
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.partitions = {}
+        for item in items:
+            self.partitions.setdefault(item[partition], []).append(item)
+        for rows in self.partitions.values():
+            rows.sort(key=lambda item: (item["timeOfCreation"], item["id"]), reverse=True)
+
+    def add(self, item):
+        with self._lock:
+            rows = list(self.partitions.get(item[self.partition], []))
+            rows.append(item)
+            rows.sort(key=lambda item: (item["timeOfCreation"], item["id"]), reverse=True)
+            self.partitions[item[self.partition]] = rows
+
+    def query(self, KeyConditionExpression, Limit=None, ExclusiveStartKey=None, Select=None, ScanIndexForward=True, **kwargs):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        conditions = _conditionValues(KeyConditionExpression)
+        partition_value = [value for name, (op, value) in conditions.items() if name != "timeOfCreation"][0]
+        rows = self.partitions.get(partition_value, [])
+        if "timeOfCreation" in conditions:
+            bound = conditions["timeOfCreation"][1]
+            rows = [row for row in rows if row["timeOfCreation"] <= bound]
+        start = 0
+        if ExclusiveStartKey is not None:
+            start = [row["id"] for row in rows].index(ExclusiveStartKey["id"]) + 1
+        end = len(rows) if Limit is None else min(start + Limit, len(rows))
+        page = rows[start:end]
+        response = {"Count": len(page)}
+        if Select != "COUNT":
+            response["Items"] = [dict(row) for row in page]
+        if end < len(rows):
+            last = page[-1]
+            response["LastEvaluatedKey"] = {name: last[name] for name in (self.partition, "code", "id", "timeOfCreation", "feedKey") if name in last}
+        return response
@@ -0,0 +1,129 @@
+"""Uniqueness of new-thing codes under concurrent creation: query-then-use vs reservation.
+
+    python benchmarks/code_allocation_bench.py [--creates 3000] [--threads 64] [--code-length 4]
+
+Both allocators run against an in-memory, thread-safe stand-in for DynamoDB with injected
+latency. The code space is shrunk (--code-length) so collisions are frequent. "query" is
+the old DEFCON 3.1 generateCode: draw a code, query for clips with it, retry on a hit; the
+code only becomes visible once the creator's clip is ingested (--ingest-delay later).
+"reserve" calls the proxy's DEFCON 3.1 branch, which reserves the code with a conditional
+put (dtt_common.codes). Reports duplicate codes handed out and round trips per create.
+"""
+import argparse
+import collections
+import contextlib
+import io
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from _harness import StubS3, loadHandler
+
+# upload keys only take well-formed session IDs (dtt_common.keys); the proxy resolves it
+# through a stub
+BENCH_SESSION_ID = "b" * 32
+
+
+class StubCodesTable:
+    """put_item honouring an attribute_not_exists condition on the key, atomically."""
+
+    name = "dothething-codes"
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.codes = set()
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def contains(self, code):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return code in self.codes
+
+    def add(self, code):
+        with self._lock:
+            self.codes.add(code)
+
+    def put_item(self, Item, ConditionExpression=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.calls += 1
+            if ConditionExpression is not None and Item["code"] in self.codes:
+                raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}, "PutItem")
+            self.codes.add(Item["code"])
+
+
+def legacyCreate(table, codes, ingest_delay):
+    while True:
+        code = "".join(random.choice(codes.CODE_ALPHABET) for _ in range(codes.CODE_LENGTH))
+        if not table.contains(code):
+            break
+    # nothing reserves the code; it shows up once the creator's upload is ingested
+    threading.Timer(ingest_delay, table.add, [code]).start()
+    return code
+
+
+def reserveCreate(module):
+    event = {"httpMethod": "POST", "headers": {"password": "ThisIsEpicPassword", "file-extension": "mp4", "session-id": BENCH_SESSION_ID}}
+    response = module.lambda_handler(event, None)
+    if response["statusCode"] != 200:
+        raise RuntimeError(response["body"])
+    key = urllib.parse.urlparse(response["body"]).path.rsplit("/", 1)[-1]
+    return key.split("-")[0]
+
+
+def run(label, create, table, creates, threads):
+    start = time.perf_counter()
+    failures = 0
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        futures = [executor.submit(create) for _ in range(creates)]
+    allocated = []
+    for future in futures:
+        try:
+            allocated.append(future.result())
+        except RuntimeError:
+            failures += 1
+    seconds = time.perf_counter() - start
+    duplicates = sum(count - 1 for count in collections.Counter(allocated).values() if count > 1)
+    return duplicates, failures, "  {:<8} {:6d} codes  {:5d} duplicates  {:4d} gave up  {:5.2f} round trips/create  {:7.1f} creates/s".format(
+        label, len(allocated), duplicates, failures, table.calls / creates, creates / seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--creates", type=int, default=3000)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--code-length", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--ingest-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    module = loadHandler("proxy")
+    codes = module.data.codes
+    codes.CODE_LENGTH = args.code_length
+    print("{} creates, {} threads, {} possible codes".format(args.creates, args.threads, len(codes.CODE_ALPHABET) ** codes.CODE_LENGTH))
+
+    table = StubCodesTable(args.latency)
+    print(run("query", lambda: legacyCreate(table, codes, args.ingest_delay), table, args.creates, args.threads)[2])
+
+    table = StubCodesTable(args.latency)
+    module.data.codes_table = table
+    module.data.s3 = StubS3({}, latency=0)
+    module.data.resolveAccountId = lambda session_id: "bench-account" if session_id == BENCH_SESSION_ID else None
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the handler prints every request
+        duplicates, failures, summary = run("reserve", lambda: reserveCreate(module), table, args.creates, args.threads)
+    print(summary)
+    if duplicates:
+        raise SystemExit("reservation handed out duplicate codes")
+    if failures:
+        raise SystemExit("{} creates failed".format(failures))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Cold start of each handler: import time and time to the first response.
+
+    python benchmarks/cold_start_bench.py [--runs 5]
+
+Every run is a fresh interpreter that imports the handler and invokes it once (cold) and
+then again (warm) with a representative event: a code page and a bare session check on the
+proxy, a homefeed page, one upload, one sign-in. AWS is a local fake endpoint
+(AWS_ENDPOINT_URL) answering DynamoDB and S3 calls with canned responses, so the numbers
+include building the clients, signing and one loopback round trip per call but no real
+service latency. The processing center ingests a 2 s clip generated with ffmpeg (skipped
+if ffmpeg isn't on PATH); the sign-in handler's Google verification is stubbed out and it
+is skipped if google-auth isn't installed.
+"""
+import argparse
+import http.server
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+START = time.perf_counter()
+
+# label: (handler, event)
+EVENTS = {
+    "proxy": ("proxy", {"httpMethod": "GET", "headers": {"password": "ThisIsEpicPassword", "code": "bench", "batch-index": "0"}}),
+    "session": ("proxy", {"httpMethod": "GET", "headers": {"password": "ThisIsEpicPassword", "session-id": "bench-session"}}),
+    "homefeed": ("homefeed", {"httpMethod": "GET", "headers": {"password": "ThisIsEpicPassword", "session-id": "bench-session", "batch-index": "0"}}),
+    "processing": ("processing", {"Records": [{"s3": {"bucket": {"name": "dothethingvideos"}, "object": {"key": "abcd1234-{}-{}.mp4".format("0" * 32, "b" * 32)}}}]}),
+    "signin": ("signin", {"httpMethod": "POST", "body": json.dumps({"idToken": "bench"})}),
+}
+
+
+def wireItem(index):
+    return {
+        "code": {"S": "bench"},
+        "id": {"S": "bench-{:032x}-bench-session.mp4".format(index)},
+        "accountId": {"S": "bench-account"},
+        "timeOfCreation": {"N": str(1000 + index)},
+    }
+
+
+class FakeAws(http.server.BaseHTTPRequestHandler):
+    video = b""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b"", content_type="application/x-amz-json-1.0", headers=()):
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"bench"')
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_POST(self):
+        request = self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        operation = self.headers.get("X-Amz-Target", "").split(".")[-1]
+        if operation == "Query" and b"sessionId-index" in request:
+            items = [{"id": {"S": "bench-account"}}]
+            body = {"Items": items, "Count": 1, "ScannedCount": 1}
+        elif operation == "Query":
+            items = [wireItem(i) for i in range(33)]
+            body = {"Items": items, "Count": len(items), "ScannedCount": len(items)}
+        elif operation == "GetItem" and b"dothething-sessions" in request:
+            body = {"Item": {"accountId": {"S": "bench-account"}, "expiresAt": {"N": str(int(time.time()) + 3600)}}}
+        elif operation == "GetItem":
+            body = {"Item": {"id": {"S": "bench-account"}, "interactions": {"N": "3"}}}
+        elif operation == "BatchWriteItem":
+            body = {"UnprocessedItems": {}}
+        else:
+            body = {}
+        self.reply(200, json.dumps(body).encode())
+
+    def do_GET(self):
+        if self.path.split("?")[0].endswith(".mp4") and self.video:
+            # ffmpeg seeks with Range requests
+            match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else len(self.video) - 1
+                content_range = ("Content-Range", "bytes {}-{}/{}".format(start, end, len(self.video)))
+                self.reply(206, self.video[start:end + 1], "video/mp4", [content_range, ("Accept-Ranges", "bytes")])
+            else:
+                self.reply(200, self.video, "video/mp4", [("Accept-Ranges", "bytes")])
+        else:
+            self.reply(200, b"\xff\xd8\xff\xd9", "image/jpeg")
+
+    do_HEAD = do_GET
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        self.reply(200, content_type="application/xml")
+
+
+def child(label):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from _harness import loadHandler
+    name, event = EVENTS[label]
+    module = loadHandler(name)
+    imported = time.perf_counter()
+    if name == "signin":
+        module.google_certs.verifyIdToken = lambda *args, **kwargs: {"iss": "accounts.google.com", "sub": "bench-account"}
+    response = module.lambda_handler(event, None)
+    first = time.perf_counter()
+    module.lambda_handler(event, None)
+    warm = time.perf_counter() - first
+    status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+    print(json.dumps({"import": imported - START, "first": first - START, "warm": warm, "status": status}))
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "--child":
+        child(sys.argv[2])
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if shutil.which("ffmpeg"):
+            clip = os.path.join(tmp, "clip.mp4")
+            subprocess.run(["ffmpeg", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=duration=2:size=1280x720:rate=30",
+                            "-pix_fmt", "yuv420p", clip], check=True)
+            with open(clip, "rb") as f:
+                FakeAws.video = f.read()
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeAws)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        env = dict(os.environ, AWS_ENDPOINT_URL="http://127.0.0.1:{}".format(server.server_address[1]),
+                   AWS_DEFAULT_REGION="us-west-1", AWS_ACCESS_KEY_ID="bench", AWS_SECRET_ACCESS_KEY="bench")
+        print("{:<11} {:>10} {:>14} {:>10}".format("event", "import", "first response", "warm"))
+        for name in EVENTS:
+            if EVENTS[name][0] == "processing" and not FakeAws.video:
+                print("{:<11} skipped (no ffmpeg)".format(name))
+                continue
+            results = []
+            for _ in range(args.runs):
+                run = subprocess.run([sys.executable, __file__, "--child", name], env=env,
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                if run.returncode != 0:
+                    break
+                results.append(json.loads(run.stdout.decode().strip().splitlines()[-1]))
+            if not results:
+                print("{:<11} skipped ({})".format(name, run.stderr.decode().strip().splitlines()[-1]))
+                continue
+            if results[0]["status"] != 200:
+                print("{:<11} failed (status {})".format(name, results[0]["status"]))
+                continue
+            median = lambda field: statistics.median(result[field] for result in results) * 1000
+            print("{:<11} {:>7.1f} ms {:>11.1f} ms {:>7.1f} ms".format(name, median("import"), median("first"), median("warm")))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
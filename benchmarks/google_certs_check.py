@@ -0,0 +1,193 @@
+"""Google ID token verification against the container-cached certs (dtt_common.google_certs).
+
+    python benchmarks/google_certs_check.py
+
+Google's certs endpoint is a local fake serving {key id: PEM} for self-signed certificates,
+and the tokens are signed here with the matching keys, so nothing leaves the machine. Checks
+that a valid token verifies and that a wrong audience, an expired token, a wrong issuer or a
+malformed token is rejected; that the certs are fetched once and then served from memory;
+that a token with an unknown key id refreshes them (Google rotated keys), but not more than
+once per GOOGLE_CERTS_MIN_REFRESH_INTERVAL; that expired certs keep working while the
+endpoint is down, until GOOGLE_CERTS_STALE_TTL runs out; and that a new container starts
+warm from the copy in GOOGLE_CERTS_CACHE_FILE. Time passing is simulated by moving the
+cached certs' timestamps back. Exits non-zero if any check fails.
+"""
+import datetime
+import http.server
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from _harness import REPO_ROOT
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+AUDIENCE = "bench-client-id.apps.googleusercontent.com"
+MAX_AGE = 300
+STALE_TTL = 3600
+MIN_REFRESH_INTERVAL = 60
+
+
+class FakeCertsServer:
+    """Serves the current certs with a Cache-Control max-age, or 503 while down."""
+
+    def __init__(self):
+        self.certs = {}
+        self.down = False
+        self.requests = 0
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests += 1
+                if fake.down:
+                    self.send_response(503)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = json.dumps(fake.certs).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", "public, max-age={}, must-revalidate".format(MAX_AGE))
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}/oauth2/v1/certs".format(self.server.server_address[1])
+
+
+# (signer, certificate PEM) for a new self-signed key, like the ones Google publishes
+def signingKey(key_id):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, key_id)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=1))
+                   .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return crypt.RSASigner.from_string(private_pem, key_id=key_id), certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def token(signer, **claims):
+    now = int(time.time())
+    payload = {"iss": "https://accounts.google.com", "aud": AUDIENCE, "sub": "bench-account", "iat": now, "exp": now + 3600}
+    payload.update(claims)
+    return jwt.encode(signer, payload).decode()
+
+
+# a fresh copy of dtt_common.google_certs, as a new container would import it
+def loadGoogleCerts():
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    spec = importlib.util.spec_from_file_location("bench_google_certs", os.path.join(REPO_ROOT, "dtt_common", "google_certs.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# moves the cached certs seconds into the past, as if that much time had gone by
+def age(module, seconds):
+    module.cached_certs["fetched_at"] -= seconds
+    module.cached_certs["expires_at"] -= seconds
+
+
+class Checks:
+    def __init__(self):
+        self.failed = []
+
+    def check(self, label, passed):
+        print("  {:<4} {}".format("ok" if passed else "FAIL", label))
+        if not passed:
+            self.failed.append(label)
+
+    def verifies(self, label, module, id_token):
+        try:
+            module.verifyIdToken(id_token, AUDIENCE)
+        except ValueError as err:
+            print("       {}".format(err))
+            self.check(label, False)
+            return
+        self.check(label, True)
+
+    def rejects(self, label, module, id_token, error=ValueError):
+        try:
+            module.verifyIdToken(id_token, AUDIENCE)
+        except error:
+            self.check(label, True)
+            return
+        self.check(label, False)
+
+
+def main():
+    server = FakeCertsServer()
+    cache_dir = tempfile.mkdtemp(prefix="google-certs-")
+    os.environ["GOOGLE_CERTS_URL"] = server.url
+    os.environ["GOOGLE_CERTS_CACHE_FILE"] = os.path.join(cache_dir, "google-oauth2-certs.json")
+    os.environ["GOOGLE_CERTS_STALE_TTL"] = str(STALE_TTL)
+    os.environ["GOOGLE_CERTS_MIN_REFRESH_INTERVAL"] = str(MIN_REFRESH_INTERVAL)
+
+    old_signer, old_cert = signingKey("old-key")
+    new_signer, new_cert = signingKey("new-key")
+    forged_signer, _ = signingKey("forged-key")
+    server.certs = {"old-key": old_cert}
+    checks = Checks()
+    module = loadGoogleCerts()
+
+    print("verification")
+    checks.verifies("valid token", module, token(old_signer))
+    checks.rejects("wrong audience", module, token(old_signer, aud="someone-else.apps.googleusercontent.com"))
+    checks.rejects("expired", module, token(old_signer, iat=int(time.time()) - 7200, exp=int(time.time()) - 3600))
+    checks.rejects("wrong issuer", module, token(old_signer, iss="https://accounts.example.com"))
+    checks.rejects("malformed", module, "not-a-token")
+    checks.rejects("signed by a key Google never published", module, token(forged_signer, sub="forged"))
+    checks.verifies("valid token again", module, token(old_signer))
+    checks.check("certs fetched once ({} requests)".format(server.requests), server.requests == 1)
+
+    print("key rotation")
+    server.certs = {"old-key": old_cert, "new-key": new_cert}
+    checks.rejects("new key within the refresh interval is not fetched yet", module, token(new_signer))
+    checks.check("no refetch within the refresh interval ({} requests)".format(server.requests), server.requests == 1)
+    age(module, MIN_REFRESH_INTERVAL + 1)
+    checks.verifies("new key after the refresh interval", module, token(new_signer))
+    checks.check("refetched once for the new key ({} requests)".format(server.requests), server.requests == 2)
+    checks.verifies("old key still valid", module, token(old_signer))
+
+    print("warm start")
+    server.down = True
+    warm = loadGoogleCerts()
+    checks.verifies("new container verifies from the cached copy", warm, token(new_signer))
+    checks.check("new container didn't fetch ({} requests)".format(server.requests), server.requests == 2)
+
+    print("stale fallback")
+    age(module, MAX_AGE + 1)
+    checks.verifies("expired certs used while the endpoint is down", module, token(new_signer))
+    checks.check("refresh was attempted ({} requests)".format(server.requests), server.requests == 3)
+    age(module, STALE_TTL)
+    checks.rejects("fetch error raised once the stale window is over", module, token(new_signer), error=module.requests.RequestException)
+    server.down = False
+    checks.verifies("recovers when the endpoint is back", module, token(new_signer))
+
+    server.server.shutdown()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    if checks.failed:
+        raise SystemExit("{} checks failed: {}".format(len(checks.failed), ", ".join(checks.failed)))
+    print("all checks passed")
+
+
+if __name__ == "__main__":
+    main()
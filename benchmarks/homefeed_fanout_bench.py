@@ -0,0 +1,33 @@
+"""Homefeed page latency against the number of codes an account has posted to.
+
+    python benchmarks/homefeed_fanout_bench.py [--latency 0.01] [--clips-per-code 50]
+"""
+import argparse
+from decimal import Decimal
+
+from _harness import StubVideosTable, loadHandler, timeIt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per stubbed query")
+    parser.add_argument("--clips-per-code", type=int, default=50)
+    args = parser.parse_args()
+
+    module = loadHandler("homefeed")
+    for num_codes in (1, 5, 10, 25, 50, 100):
+        codes = ["code{}".format(i) for i in range(num_codes)]
+        items = []
+        for i, code in enumerate(codes):
+            for j in range(args.clips_per_code):
+                items.append({"code": code, "id": "{}-{}".format(code, j), "timeOfCreation": Decimal(j * num_codes + i), "accountId": "a"})
+        module.data.videos_table = StubVideosTable(items, latency=args.latency)
+        row = ["codes={:>3}".format(num_codes)]
+        for workers in (1, 8, 32):
+            seconds = timeIt(lambda: module.getHomefeedPage(codes, 0, max_workers=workers), repeat=3)
+            row.append("workers={:>2} {:7.1f} ms".format(workers, seconds * 1000))
+        print("  ".join(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Memory and latency of thumbnail extraction: full download vs streaming from a URL.
+
+    python benchmarks/ingest_stream_bench.py video.mp4 [more.mov ...]
+
+The files are served by a local HTTP server with Range support, standing in for S3
+presigned GETs. "download" reproduces the old ingest (read the whole body into memory,
+write it to a temp file, run ffmpeg on the file); "stream" runs the processing center's
+renditionsFromInput on the URL. Each run happens in a fresh interpreter so the peak
+Python heap and the ffmpeg child's max RSS are measured per mode.
+"""
+import argparse
+import http.server
+import json
+import os
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    bytes_served = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # keep socket buffering small so "read" reflects what ffmpeg actually consumed
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 64 * 1024)
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.match(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            if match.group(1):
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(int(match.group(2)), size - 1)
+            else:
+                start = max(size - int(match.group(2)), 0)
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        else:
+            self.send_response(200)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(remaining, 64 * 1024))
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+                    with RangeHandler.lock:
+                        RangeHandler.bytes_served += len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+def runDownload(url):
+    body = urllib.request.urlopen(url).read()
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "video")
+        with open(video, "wb") as f:
+            f.write(body)
+        thumbnail = os.path.join(tmp, "thumbnail.jpg")
+        subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-i", video, "-ss", "00:00:01.000", "-vframes", "1", thumbnail], check=True)
+        with open(thumbnail, "rb") as f:
+            return f.read()
+
+
+def child(mode, url):
+    if mode == "stream":
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from _harness import loadHandler
+        renditionsFromInput = loadHandler("processing").renditionsFromInput
+        run = lambda url: renditionsFromInput(url)["preview.jpg"]
+    else:
+        run = runDownload
+    tracemalloc.start()
+    start = time.perf_counter()
+    thumbnail = run(url)
+    seconds = time.perf_counter() - start
+    _, python_peak = tracemalloc.get_traced_memory()
+    ffmpeg_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    print(json.dumps({"seconds": seconds, "python_peak": python_peak, "ffmpeg_rss": ffmpeg_rss, "thumbnail": len(thumbnail)}))
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        child(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("videos", nargs="+")
+    args = parser.parse_args()
+
+    for video in args.videos:
+        directory, name = os.path.split(os.path.abspath(video))
+        handler = lambda *a, **kw: RangeHandler(*a, directory=directory, **kw)
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}/{}".format(server.server_address[1], urllib.request.quote(name))
+        print("{} ({:.1f} MB)".format(name, os.path.getsize(video) / 1e6))
+        for mode in ("download", "stream"):
+            RangeHandler.bytes_served = 0
+            output = subprocess.run([sys.executable, __file__, "--child", mode, url], stdout=subprocess.PIPE, check=True).stdout
+            result = json.loads(output.decode().strip().splitlines()[-1])
+            print("  {:<8}  {:7.1f} ms  python peak {:7.1f} MB  ffmpeg rss {:6.1f} MB  read {:7.1f} MB".format(
+                mode, result["seconds"] * 1000, result["python_peak"] / 1e6, result["ffmpeg_rss"] / 1e6, RangeHandler.bytes_served / 1e6))
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Feed page JSON encoding: the old DecimalEncoder against dtt_common.serializer.dumps.
+
+    python benchmarks/json_encode_bench.py [--pages 2000] [--inline]
+
+Pages are 33 clips shaped like what processVideos returns (thumbnail URLs, or ~20 KB
+base64 thumbnails with --inline), with the Decimals DynamoDB hands back. "peak" is the
+largest tracemalloc peak while encoding one page.
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-1")
+from dtt_common import serializer  # noqa: E402
+from dtt_common.pagination import PAGE_SIZE  # noqa: E402
+
+
+# what the handlers used before dtt_common.serializer.dumps
+class DecimalEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, Decimal):
+            return str(obj)
+        return json.JSONEncoder.default(self, obj)
+
+
+def page(inline):
+    videos = []
+    for i in range(PAGE_SIZE):
+        video_id = "a1B2c3D4-{:032x}-{:032x}.mp4".format(i, i * 7919)
+        video = {
+            "code": "a1B2c3D4",
+            "id": video_id,
+            "timeOfCreation": Decimal(1700000000000 + i * 1000),
+            "thumbnailRendition": "preview.webp",
+        }
+        if inline:
+            video["thumbnailBase64"] = base64.b64encode(os.urandom(15000)).decode("utf-8")
+        else:
+            video["thumbnailUrl"] = "https://dothethingthumbnails.s3.amazonaws.com/{}.preview.webp?X-Amz-Algorithm=AWS4-HMAC-SHA256&X-Amz-Credential={}&X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600&X-Amz-SignedHeaders=host&X-Amz-Signature={}".format(video_id, "A" * 120, "f" * 64)
+        videos.append(video)
+    return videos
+
+
+def measure(encode, pages):
+    start = time.perf_counter()
+    for videos in pages:
+        encode(videos)
+    seconds = time.perf_counter() - start
+
+    peak = 0
+    tracemalloc.start()
+    for videos in pages[:50]:
+        tracemalloc.reset_peak()
+        encode(videos)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+    return len(pages) / seconds, peak, len(encode(pages[0]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--inline", action="store_true", help="inline base64 thumbnails instead of URLs")
+    args = parser.parse_args()
+
+    pages = [page(args.inline) for _ in range(min(args.pages, 100))]
+    pages = (pages * (args.pages // len(pages) + 1))[:args.pages]
+
+    # dumps uses orjson only if it could be imported, so each run sets it explicitly
+    orjson = serializer.orjson
+    encoders = [
+        ("DecimalEncoder", lambda videos: json.dumps(videos, cls=DecimalEncoder), None),
+        ("dumps (json)", serializer.dumps, None),
+    ]
+    if orjson is not None:
+        encoders.append(("dumps (orjson)", serializer.dumps, orjson))
+
+    print("{} pages of {} clips, {} thumbnails".format(args.pages, PAGE_SIZE, "inline" if args.inline else "URL"))
+    for name, encode, accelerator in encoders:
+        serializer.orjson = accelerator
+        rate, peak, size = measure(encode, pages)
+        print("{:<15} {:9.0f} pages/s  peak {:8.1f} KB  body {:8.1f} KB".format(name, rate, peak / 1024, size / 1024))
+    if orjson is None:
+        print("orjson isn't installed; pip install orjson to compare it")
+
+if __name__ == "__main__":
+    main()
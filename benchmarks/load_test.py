@@ -0,0 +1,407 @@
+"""End-to-end load test of every lambda_handler against moto-backed DynamoDB and S3.
+
+    pip install "moto[dynamodb,s3]"
+    python benchmarks/load_test.py [--requests 300] [--concurrency 16]
+        [--dynamodb-latency 0.005] [--s3-latency 0.01] [--json results.json]
+        [--baseline results.json --tolerance 0.25 --call-tolerance 0.05]
+
+The tables (accounts, sessions, videos metadata, homefeed, codes) and both buckets are
+created in moto and seeded with --accounts accounts posting --clips clips across --codes
+codes, each clip with a thumbnail. Every AWS call then sleeps for the service's injected
+latency before moto answers it, standing in for the network round trip. moto answers a
+query by walking the whole table, which at these volumes costs more than anything being
+measured, so queries on the videos and homefeed tables are answered from in-memory copies
+instead (same latency, still counted; writes go to both).
+
+Each scenario drives one endpoint through its lambda_handler from --concurrency threads,
+like that many warm containers, and reports throughput, p50/p95/p99 latency, DynamoDB/S3
+calls per request (presigning is local and not counted) and the mean response body. The
+processing center's ffmpeg step is replaced by fixed renditions (renditions_bench.py
+measures it) and sign-in skips Google's token check.
+
+With --baseline, the run fails if any scenario's p95 grew by more than --tolerance (and
+5 ms) or its DynamoDB/S3 calls per request by more than --call-tolerance over the saved
+--json results, so it can gate a deploy.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-west-1")
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+# the EMF records assume one invocation at a time per process, which isn't the case here
+os.environ["METRICS_SAMPLE_RATE"] = "0"
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+
+from _harness import REPO_ROOT, StubVideosTable, loadHandler  # noqa: E402
+
+sys.path.insert(0, REPO_ROOT)
+
+from dtt_common import homefeed_index, trending  # noqa: E402
+from dtt_common.codes import CODE_ALPHABET, CODE_LENGTH  # noqa: E402
+
+PASSWORD = "ThisIsEpicPassword"
+THUMBNAIL = bytes(random.Random(0).getrandbits(8) for _ in range(6000))
+
+
+def createTables():
+    client = boto3.client("dynamodb")
+
+    def create(name, keys, attributes, indexes=()):
+        params = {
+            "TableName": name,
+            "BillingMode": "PAY_PER_REQUEST",
+            "KeySchema": [{"AttributeName": key, "KeyType": key_type} for key, key_type in keys],
+            "AttributeDefinitions": [{"AttributeName": key, "AttributeType": key_type} for key, key_type in attributes],
+        }
+        if indexes:
+            params["GlobalSecondaryIndexes"] = [
+                {"IndexName": index, "KeySchema": [{"AttributeName": key, "KeyType": key_type} for key, key_type in index_keys], "Projection": {"ProjectionType": "ALL"}}
+                for index, index_keys in indexes
+            ]
+        client.create_table(**params)
+
+    create("dothething-accounts", [("id", "HASH")], [("id", "S"), ("sessionId", "S")],
+           [("sessionId-index", [("sessionId", "HASH")])])
+    create("dothething-sessions", [("sessionId", "HASH")], [("sessionId", "S")])
+    create("dothething-codes", [("code", "HASH")], [("code", "S")])
+    create("dothething-homefeed", [("accountId", "HASH"), ("feedKey", "RANGE")], [("accountId", "S"), ("feedKey", "S")])
+    create("dothethingvideos-metadata", [("code", "HASH"), ("id", "RANGE")],
+           [("code", "S"), ("id", "S"), ("accountId", "S"), ("timeOfCreation", "N")],
+           [("accountId-index", [("accountId", "HASH")]),
+            ("code-timeOfCreation-index", [("code", "HASH"), ("timeOfCreation", "RANGE")]),
+            ("accountId-timeOfCreation-index", [("accountId", "HASH"), ("timeOfCreation", "RANGE")])])
+    create(trending.TRENDING_TABLE, [("epoch", "HASH"), ("code", "RANGE")], [("epoch", "N"), ("code", "S"), ("score", "N")],
+           [(trending.TRENDING_INDEX, [("epoch", "HASH"), ("score", "RANGE")])])
+    s3 = boto3.client("s3")
+    for bucket in ("dothethingvideos", "dothethingthumbnails"):
+        s3.create_bucket(Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": os.environ["AWS_DEFAULT_REGION"]})
+
+
+# accounts with one session each, clips spread over codes (each account posts to a few),
+# a thumbnail per clip, the materialized homefeed and a trending ranking; returns what the scenarios draw from
+def seed(num_accounts, num_codes, num_clips):
+    rng = random.Random(1)
+    dynamodb = boto3.resource("dynamodb")
+    s3 = boto3.client("s3")
+    accounts = ["account{:05d}".format(i) for i in range(num_accounts)]
+    sessions = {account: uuid.UUID(int=rng.getrandbits(128)).hex for account in accounts}
+    codes = ["".join(rng.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH)) for _ in range(num_codes)]
+    account_codes = {account: rng.sample(codes, min(len(codes), rng.randint(1, 6))) for account in accounts}
+
+    expires_at = int(time.time()) + 86400
+    with dynamodb.Table("dothething-accounts").batch_writer() as accounts_batch, dynamodb.Table("dothething-sessions").batch_writer() as sessions_batch:
+        for account in accounts:
+            accounts_batch.put_item(Item={"id": account, "sessionId": sessions[account], "interactions": rng.randint(0, 500), "timeOfCreation": 1700000000000})
+            sessions_batch.put_item(Item={"sessionId": sessions[account], "accountId": account, "timeOfCreation": 1700000000000, "expiresAt": expires_at})
+
+    videos = []
+    with dynamodb.Table("dothethingvideos-metadata").batch_writer() as videos_batch, dynamodb.Table("dothething-codes").batch_writer() as codes_batch:
+        for code in codes:
+            codes_batch.put_item(Item={"code": code, "sessionId": "seed", "timeOfCreation": 1700000000000})
+        for i in range(num_clips):
+            account = rng.choice(accounts)
+            code = rng.choice(account_codes[account])
+            video = {
+                "code": code,
+                "id": "{}-{}-{}.mp4".format(code, uuid.UUID(int=rng.getrandbits(128)).hex, sessions[account]),
+                "timeOfCreation": Decimal(1700000000000 + i * 1000),
+                "accountId": account,
+                "renditions": ["preview.jpg"],
+            }
+            videos_batch.put_item(Item=video)
+            videos.append(video)
+    for video in videos:
+        s3.put_object(Bucket="dothethingthumbnails", Key="{}.jpg".format(video["id"]), Body=THUMBNAIL)
+    s3.put_object(Bucket="dothethingthumbnails", Key="obama.jpg", Body=THUMBNAIL)
+
+    members = {}
+    for video in videos:
+        members.setdefault(video["code"], set()).add(video["accountId"])
+    feed = [homefeed_index.feedEntry(account, video) for video in videos for account in members[video["code"]]]
+    with dynamodb.Table(homefeed_index.HOMEFEED_TABLE).batch_writer() as feed_batch:
+        for entry in feed:
+            feed_batch.put_item(Item=entry)
+
+    # the seeded clips are years old, so each code's ranking row is made up for the current epochs
+    now = time.time()
+    with dynamodb.Table(trending.TRENDING_TABLE).batch_writer() as trending_batch:
+        for code in members:
+            latest = max((video for video in videos if video["code"] == code), key=lambda video: video["timeOfCreation"])
+            for epoch in trending.epochsAt(now):
+                trending_batch.put_item(Item={"epoch": epoch, "code": code, "score": Decimal(rng.randint(1, 10000)), "clips": rng.randint(1, 50),
+                                              "latestId": latest["id"], "latestRenditions": latest["renditions"]})
+
+    posted = set(video["accountId"] for video in videos)
+    return {
+        "videos": videos,
+        "feed": feed,
+        "sessions": [sessions[account] for account in accounts if account in posted],
+        "codes": sorted(members),
+        "ids": [video["id"] for video in videos],
+    }
+
+
+# counts every DynamoDB/S3 API call and sleeps for the service's latency before moto
+# handles it; presigned URLs never get here
+class AwsCalls:
+    def __init__(self, latencies):
+        self.latencies = latencies
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event_name, **kwargs):
+        self.call(event_name.split(".")[1])
+
+    def call(self, service):
+        with self._lock:
+            self.counts[service] = self.counts.get(service, 0) + 1
+        latency = self.latencies.get(service, 0)
+        if latency > 0:
+            time.sleep(latency)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+# a moto table whose queries are answered from in-memory copies, one per index (None for
+# the table itself) keyed on that index's partition attribute; writes go to both
+class IndexedTable:
+    def __init__(self, table, indexes, items, calls):
+        self.table = table
+        self.calls = calls
+        self.indexes = {name: StubVideosTable(items, partition, latency=0) for name, partition in indexes.items()}
+
+    def query(self, IndexName=None, **kwargs):
+        self.calls.call("dynamodb")
+        return self.indexes[IndexName].query(**kwargs)
+
+    def put_item(self, **kwargs):
+        response = self.table.put_item(**kwargs)
+        self.remember(kwargs["Item"])
+        return response
+
+    def remember(self, item):
+        for index in self.indexes.values():
+            index.add(dict(item))
+
+    @contextlib.contextmanager
+    def batch_writer(self, **kwargs):
+        with self.table.batch_writer(**kwargs) as batch:
+            yield MirroredBatch(batch, self)
+
+    def __getattr__(self, name):
+        return getattr(self.table, name)
+
+
+class MirroredBatch:
+    def __init__(self, batch, table):
+        self.batch = batch
+        self.table = table
+
+    def put_item(self, Item):
+        self.batch.put_item(Item=Item)
+        self.table.remember(Item)
+
+
+def scenarios(seeded):
+    rng = random.Random(2)
+
+    def get(**headers):
+        return {"httpMethod": "GET", "headers": dict(headers, password=PASSWORD)}
+
+    def session():
+        return rng.choice(seeded["sessions"])
+
+    def code():
+        return rng.choice(seeded["codes"])
+
+    # ingest HEADs the upload before transcoding (ffmpeg itself is stubbed out), so the
+    # object has to exist; it is written while the events are made, before the clock starts
+    def upload():
+        key = "{}-{}-{}.mp4".format(code(), uuid.uuid4().hex, session())
+        boto3.client("s3").put_object(Bucket="dothethingvideos", Key=key, Body=THUMBNAIL, ContentType="video/mp4")
+        return {"Records": [{"s3": {"bucket": {"name": "dothethingvideos"}, "object": {"key": key}}}]}
+
+    return [
+        ("account page", "proxy", None, lambda: get(**{"session-id": session(), "batch-index": "0"})),
+        ("code page", "proxy", None, lambda: get(**{"code": code(), "batch-index": "0"})),
+        ("code page inline", "proxy", None, lambda: get(**{"code": code(), "batch-index": "0", "thumbnail-format": "base64"})),
+        ("session check", "proxy", None, lambda: get(**{"session-id": session()})),
+        ("trending", "proxy", None, lambda: get(trending="true")),
+        ("video urls", "proxy", None, lambda: get(ids=",".join(rng.sample(seeded["ids"], 20)))),
+        ("upload to code", "proxy", None, lambda: {"httpMethod": "PUT", "headers": {"password": PASSWORD, "code": code(), "file-extension": "mp4", "session-id": session()}}),
+        ("create code", "proxy", None, lambda: {"httpMethod": "POST", "headers": {"password": PASSWORD, "file-extension": "mp4", "session-id": session()}}),
+        ("homefeed live", "homefeed", "live", lambda: get(**{"session-id": session(), "batch-index": "0"})),
+        ("homefeed index", "homefeed", "index", lambda: get(**{"session-id": session(), "batch-index": "0"})),
+        ("interactions", "homefeed", None, lambda: get(**{"session-id": session()})),
+        ("ingest", "processing", None, upload),
+        ("sign-in", "signin", None, lambda: {"httpMethod": "POST", "body": json.dumps({"idToken": "load-test"})}),
+    ]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(handler, events, concurrency, calls):
+    latencies = []
+    sizes = []
+    failures = 0
+    lock = threading.Lock()
+
+    def invoke(event):
+        nonlocal failures
+        start = time.perf_counter()
+        try:
+            response = handler(event, None)
+            # the processing center returns nothing for S3 events
+            status = response.get("statusCode", 200) if isinstance(response, dict) else 200
+        except Exception:
+            response = None
+            status = 500
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if isinstance(response, dict) and isinstance(response.get("body"), str):
+                sizes.append(len(response["body"]))
+            if status >= 400:
+                failures += 1
+
+    before = calls.snapshot()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(invoke, events))
+    seconds = time.perf_counter() - start
+    after = calls.snapshot()
+    per_request = {service: (after.get(service, 0) - before.get(service, 0)) / len(events) for service in ("dynamodb", "s3")}
+    return {
+        "requests": len(events),
+        "throughput": len(events) / seconds,
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "dynamodbCalls": per_request["dynamodb"],
+        "s3Calls": per_request["s3"],
+        "bodyBytes": statistics.mean(sizes) if sizes else 0,
+        "failures": failures,
+    }
+
+
+# p95 regressions beyond tolerance (and 5 ms), and growth in calls per request beyond
+# call_tolerance. With the same options the events and seeded data are the same, so calls
+# only move when the code does, give or take which thread fills a cache first and which
+# accounts sign in; call_tolerance is the slack for that
+def regressions(results, baseline, tolerance, call_tolerance):
+    found = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before, after = baseline[name]["p95"], result["p95"]
+        if after > before * (1 + tolerance) and after - before > 5:
+            found.append("{}: p95 {:.1f} -> {:.1f} ms".format(name, before, after))
+        for field in ("dynamodbCalls", "s3Calls"):
+            before, after = baseline[name][field], result[field]
+            if after > before * (1 + call_tolerance) + 0.01:
+                found.append("{}: {} per request {:.2f} -> {:.2f}".format(name, field, before, after))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--clips", type=int, default=3000)
+    parser.add_argument("--dynamodb-latency", type=float, default=0.005, help="seconds added to every DynamoDB call")
+    parser.add_argument("--s3-latency", type=float, default=0.01, help="seconds added to every S3 call")
+    parser.add_argument("--only", help="comma-separated scenario names")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results from an earlier --json run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p95 growth over the baseline")
+    parser.add_argument("--call-tolerance", type=float, default=0.05, help="allowed growth in calls per request over the baseline")
+    args = parser.parse_args()
+    options = {name: getattr(args, name) for name in ("requests", "concurrency", "accounts", "codes", "clips", "dynamodb_latency", "s3_latency")}
+
+    logging.disable(logging.WARNING)
+    with mock_aws():
+        createTables()
+        started = time.perf_counter()
+        seeded = seed(args.accounts, args.codes, args.clips)
+        print("seeded {} accounts, {} codes, {} clips in {:.1f} s".format(args.accounts, args.codes, args.clips, time.perf_counter() - started))
+
+        # the handlers' clients come from the default session, so the hooks see every call
+        calls = AwsCalls({"dynamodb": args.dynamodb_latency, "s3": args.s3_latency})
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register("before-call.dynamodb", calls)
+        boto3.DEFAULT_SESSION.events.register("before-call.s3", calls)
+
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            # the handlers print as they go
+            modules = {name: loadHandler(name) for name in ("proxy", "homefeed", "processing", "signin")}
+        data_layer = modules["proxy"].data
+        data_layer.videos_table = IndexedTable(data_layer.videos_table, {
+            None: "code",
+            "code-timeOfCreation-index": "code",
+            "accountId-timeOfCreation-index": "accountId",
+            "accountId-index": "accountId",
+        }, seeded["videos"], calls)
+        data_layer.feed_table = IndexedTable(data_layer.feed_table, {None: "accountId"}, seeded["feed"], calls)
+        modules["processing"].extractRenditions = lambda bucket, key: {"preview.jpg": THUMBNAIL, "grid.jpg": THUMBNAIL[:2000]}
+        modules["signin"].google_certs.verifyIdToken = lambda token, audience: {"iss": "accounts.google.com", "sub": "account{:05d}".format(random.randrange(args.accounts))}
+
+        # warm containers have already resolved their users' sessions (dtt_common.sessions
+        # caches them), so calls per request don't depend on how many requests a run makes
+        for session_id in seeded["sessions"]:
+            data_layer.resolveAccountId(session_id)
+
+        only = set(args.only.split(",")) if args.only else None
+        results = {}
+        print("{:<18} {:>9} {:>8} {:>8} {:>8} {:>7} {:>6} {:>9} {:>5}".format(
+            "scenario", "req/s", "p50 ms", "p95 ms", "p99 ms", "ddb/req", "s3/req", "body B", "fail"))
+        for name, module_name, homefeed_source, event in scenarios(seeded):
+            if only is not None and name not in only:
+                continue
+            module = modules[module_name]
+            if homefeed_source is not None:
+                module.HOMEFEED_SOURCE = homefeed_source
+            events = [event() for _ in range(args.requests)]
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                result = run(module.lambda_handler, events, args.concurrency, calls)
+            results[name] = result
+            print("{:<18} {:>9.1f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.2f} {:>6.2f} {:>9.0f} {:>5}".format(
+                name, result["throughput"], result["p50"], result["p95"], result["p99"],
+                result["dynamodbCalls"], result["s3Calls"], result["bodyBytes"], result["failures"]))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"options": options, "scenarios": results}, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["options"] != options:
+            raise SystemExit("the baseline was run with different options: {}".format(baseline["options"]))
+        found = regressions(results, baseline["scenarios"], args.tolerance, args.call_tolerance)
+        if found:
+            raise SystemExit("regressions over {:.0%} (p95) / {:.0%} (calls):\n  {}".format(args.tolerance, args.call_tolerance, "\n  ".join(found)))
+        print("no regressions over {:.0%} (p95) / {:.0%} (calls) against {}".format(args.tolerance, args.call_tolerance, args.baseline))
+
+
+if __name__ == "__main__":
+    main()
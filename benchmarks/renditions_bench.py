@@ -0,0 +1,68 @@
+"""Feed page bytes and ingest CPU: one full-size JPEG vs the multi-rendition pipeline.
+
+    python benchmarks/renditions_bench.py video.mp4 [more.mov ...]
+
+"before" is the original ingest command (full-resolution JPEG, shipped base64 inline in
+every feed page); "after" is the processing center's renditionsFromInput, one ffmpeg run
+producing every rendition in dtt_common.renditions. Page bytes assume 33 clips per page
+using that file's thumbnails.
+"""
+import argparse
+import base64
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from _harness import loadHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtt_common import renditions  # noqa: E402
+from dtt_common.pagination import PAGE_SIZE  # noqa: E402
+
+
+def childCpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(fn, repeat=3):
+    cpu, wall = childCpu(), time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (childCpu() - cpu) / repeat, (time.perf_counter() - wall) / repeat
+
+
+def legacyThumbnail(video):
+    with tempfile.TemporaryDirectory() as tmp:
+        thumbnail = os.path.join(tmp, "thumbnail.jpg")
+        subprocess.run(["ffmpeg", "-nostdin", "-loglevel", "error", "-i", video, "-ss", "00:00:01.000", "-vframes", "1", thumbnail], check=True)
+        with open(thumbnail, "rb") as f:
+            return f.read()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("videos", nargs="+")
+    args = parser.parse_args()
+    module = loadHandler("processing")
+
+    for video in args.videos:
+        print("{} ({:.1f} MB)".format(os.path.basename(video), os.path.getsize(video) / 1e6))
+        legacy, cpu, wall = measure(lambda: legacyThumbnail(video))
+        print("  before  ffmpeg cpu {:6.1f} ms  wall {:6.1f} ms".format(cpu * 1000, wall * 1000))
+        images, cpu, wall = measure(lambda: module.renditionsFromInput(video))
+        print("  after   ffmpeg cpu {:6.1f} ms  wall {:6.1f} ms".format(cpu * 1000, wall * 1000))
+
+        print("  page bytes ({} clips):".format(PAGE_SIZE))
+        print("    {:<28} {:9.1f} KB".format("before: inline full jpg", PAGE_SIZE * len(base64.b64encode(legacy)) / 1e3))
+        for rendition in renditions.RENDITIONS:
+            size = len(images[rendition.name])
+            print("    {:<28} {:9.1f} KB  ({:.1f} KB inline)".format(
+                "after: " + rendition.name, PAGE_SIZE * size / 1e3, PAGE_SIZE * len(base64.b64encode(images[rendition.name])) / 1e3))
+
+
+if __name__ == "__main__":
+    main()
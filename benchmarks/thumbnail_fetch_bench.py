@@ -0,0 +1,40 @@
+"""Batch thumbnail fetch latency as the worker pool grows.
+
+    python benchmarks/thumbnail_fetch_bench.py [--latency 0.03] [--batch 33]
+
+Every run fetches the whole batch from the stub S3: the container's thumbnail cache is
+replaced by one that keeps nothing and the placeholder is dropped before each run, so the
+numbers are the uncached fetch a cold cache (or a page of new clips) pays.
+"""
+import argparse
+
+from _harness import StubS3, loadHandler, timeIt
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.03, help="seconds per stubbed get_object")
+    parser.add_argument("--batch", type=int, default=33)
+    parser.add_argument("--missing", type=int, default=3, help="clips in the batch without a thumbnail")
+    args = parser.parse_args()
+
+    keys = ["clip{}.jpg".format(i) for i in range(args.batch)]
+    objects = {key: b"x" * 20000 for key in keys[args.missing:]}
+    objects["obama.jpg"] = b"o" * 20000
+
+    # both feed handlers fetch thumbnails through dtt_common.serializer
+    serializer = loadHandler("proxy").serializer
+    serializer.data.s3 = StubS3(objects, latency=args.latency)
+    serializer.thumbnail_cache = serializer.ThumbnailCache(max_bytes=0, ttl=0)
+
+    def fetch(workers):
+        serializer.placeholder_thumbnail = None
+        return serializer.fetchThumbnails(keys, max_workers=workers)
+
+    for workers in (1, 4, 8, 16, 33):
+        seconds = timeIt(lambda: fetch(workers))
+        print("workers={:>2}  batch={}  {:7.1f} ms".format(workers, args.batch, seconds * 1000))
+
+
+if __name__ == "__main__":
+    main()
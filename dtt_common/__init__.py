@@ -0,0 +1,2 @@
+# code shared by the dothething lambdas; each deployment bundles this package
+# next to its handler (see the build scripts in the handler directories)
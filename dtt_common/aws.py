@@ -0,0 +1,150 @@
+import os
+import threading
+
+import boto3
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.table import BatchWriter
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+
+from dtt_common import metrics
+
+# AWS clients shared by everything in the container and built on first use rather than at
+# import, so a cold start only pays for the clients the invocation actually touches.
+# DynamoDB goes through the low-level client behind a small Table-like wrapper instead of
+# boto3.resource, which loads a second model and generates classes on every cold start.
+
+# retries with exponential backoff on throttling and transient errors; "adaptive" also
+# rate-limits the client itself once DynamoDB or S3 start throttling, instead of every
+# thread retrying into the throttle. Same variables botocore reads, different defaults.
+AWS_RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+
+_lock = threading.Lock()
+_clients = {}
+
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+
+def client(service: str, max_pool_connections: int = 10):
+    key = (service, max_pool_connections)
+    if key not in _clients:
+        # client creation on the default session isn't thread safe
+        with _lock:
+            if key not in _clients:
+                _clients[key] = boto3.client(service, config=Config(
+                    max_pool_connections=max_pool_connections,
+                    retries={'mode': AWS_RETRY_MODE, 'max_attempts': AWS_MAX_ATTEMPTS}
+                ))
+    return _clients[key]
+
+
+def serialize(item: dict) -> dict:
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+def deserialize(item: dict) -> dict:
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+# stands in for boto3.client(service) at module level; the client is built on the first call
+class Client:
+    def __init__(self, service: str, max_pool_connections: int = 10):
+        self.service = service
+        self.max_pool_connections = max_pool_connections
+
+    # client methods are timed as "<service>.<method>" (see dtt_common.metrics)
+    def __getattr__(self, name):
+        attribute = getattr(client(self.service, self.max_pool_connections), name)
+        if not callable(attribute):
+            return attribute
+        timer_name = '{}.{}'.format(self.service, name)
+
+        def timed(*args, **kwargs):
+            with metrics.timer(timer_name):
+                return attribute(*args, **kwargs)
+        return timed
+
+
+# the subset of boto3's dynamodb Table the handlers use: plain Python values and
+# boto3.dynamodb.conditions in, plain Python values (numbers as Decimal) out
+class Table:
+    def __init__(self, name: str, max_pool_connections: int = 10):
+        self.name = name
+        self.max_pool_connections = max_pool_connections
+
+    @property
+    def client(self):
+        return client('dynamodb', self.max_pool_connections)
+
+    def _call(self, operation: str, params: dict) -> dict:
+        params = dict(params, TableName=self.name)
+        builder = ConditionExpressionBuilder()
+        names = dict(params.get('ExpressionAttributeNames', {}))
+        values = dict(params.get('ExpressionAttributeValues', {}))
+        for field in ('KeyConditionExpression', 'FilterExpression', 'ConditionExpression'):
+            if isinstance(params.get(field), ConditionBase):
+                built = builder.build_expression(params[field], is_key_condition=field == 'KeyConditionExpression')
+                params[field] = built.condition_expression
+                names.update(built.attribute_name_placeholders)
+                values.update(built.attribute_value_placeholders)
+        if names:
+            params['ExpressionAttributeNames'] = names
+        if values:
+            params['ExpressionAttributeValues'] = serialize(values)
+        for field in ('Key', 'Item', 'ExclusiveStartKey'):
+            if field in params:
+                params[field] = serialize(params[field])
+
+        with metrics.timer('dynamodb.' + operation):
+            response = getattr(self.client, operation)(**params)
+        for field in ('Item', 'Attributes', 'LastEvaluatedKey'):
+            if field in response:
+                response[field] = deserialize(response[field])
+        if 'Items' in response:
+            response['Items'] = [deserialize(item) for item in response['Items']]
+        return response
+
+    def get_item(self, **kwargs) -> dict:
+        return self._call('get_item', kwargs)
+
+    def put_item(self, **kwargs) -> dict:
+        return self._call('put_item', kwargs)
+
+    def update_item(self, **kwargs) -> dict:
+        return self._call('update_item', kwargs)
+
+    def delete_item(self, **kwargs) -> dict:
+        return self._call('delete_item', kwargs)
+
+    def query(self, **kwargs) -> dict:
+        return self._call('query', kwargs)
+
+    def scan(self, **kwargs) -> dict:
+        return self._call('scan', kwargs)
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return BatchWriter(self.name, _BatchWriteClient(self), overwrite_by_pkeys=overwrite_by_pkeys)
+
+
+# what boto3's BatchWriter expects from its client: batch_write_item taking and returning
+# plain Python items
+class _BatchWriteClient:
+    def __init__(self, table: Table):
+        self.table = table
+
+    def batch_write_item(self, RequestItems: dict) -> dict:
+        with metrics.timer('dynamodb.batch_write_item'):
+            response = self.table.client.batch_write_item(
+                RequestItems={name: [_mapRequest(request, serialize) for request in requests] for name, requests in RequestItems.items()})
+        response['UnprocessedItems'] = {
+            name: [_mapRequest(request, deserialize) for request in requests]
+            for name, requests in response.get('UnprocessedItems', {}).items()}
+        return response
+
+
+def _mapRequest(request: dict, convert) -> dict:
+    if 'PutRequest' in request:
+        return {'PutRequest': {'Item': convert(request['PutRequest']['Item'])}}
+    return {'DeleteRequest': {'Key': convert(request['DeleteRequest']['Key'])}}
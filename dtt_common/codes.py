@@ -0,0 +1,59 @@
+import logging
+import os
+import secrets
+import time
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# every code handed out is reserved in its own table with a conditional put before the
+# creator uploads anything, so two concurrent creators can never get the same code:
+#   code (HASH, S) | sessionId | timeOfCreation
+# tools/backfill_codes.py reserves the codes that existed before the table did.
+CODES_TABLE = os.environ.get('CODES_TABLE', 'dothething-codes')
+CODE_ALPHABET = '123456789abcdefABCDEF'
+CODE_LENGTH = 8
+# with 21^8 possible codes a collision is rare, so more than a couple of attempts means
+# something is wrong
+CODE_ALLOCATION_ATTEMPTS = 5
+
+
+def randomCode() -> str:
+    # codes give access to their clips, so they come from the OS CSPRNG
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+
+
+# reserves and returns a code nobody else has, in one conditional write per attempt
+def allocateCode(codes_table, session_id: str) -> str:
+    for _ in range(CODE_ALLOCATION_ATTEMPTS):
+        code = randomCode()
+        try:
+            codes_table.put_item(
+                Item={'code': code, 'sessionId': session_id, 'timeOfCreation': int(time.time() * 1000)},
+                ConditionExpression=Attr('code').not_exists()
+            )
+        except ClientError as err:
+            if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                logger.error(
+                    "Couldn't reserve code %s in table %s. Here's why: %s: %s", code, codes_table.name,
+                    err.response['Error']['Code'], err.response['Error']['Message'])
+                raise
+            logger.info("Code %s is taken, drawing another", code)
+        else:
+            return code
+    raise RuntimeError("Couldn't find a free code in {} attempts".format(CODE_ALLOCATION_ATTEMPTS))
+
+
+# whether code has been handed out (reserved by allocateCode or the backfill). Uploads only
+# go to reserved codes, or a clip could claim a code allocateCode later gives someone else.
+def isReserved(codes_table, code: str) -> bool:
+    try:
+        response = codes_table.get_item(Key={'code': code}, ConsistentRead=True)
+    except ClientError as err:
+        logger.error(
+            "Couldn't get code %s from table %s. Here's why: %s: %s", code, codes_table.name,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    return 'Item' in response
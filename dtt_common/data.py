@@ -0,0 +1,223 @@
+import logging
+import os
+import threading
+import time
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+from dtt_common import aws, codes, homefeed_index, interactions, sessions, trending
+from dtt_common.pagination import PAGE_SIZE, decodePageToken, queryPage
+
+logger = logging.getLogger()
+
+# data access shared by every handler: the table and bucket names, the clients (built on
+# first use, retrying with backoff, see dtt_common.aws) and the reads and writes more than
+# one handler needs. Handlers go through this module rather than holding their own tables.
+VIDEOS_TABLE = os.environ.get('VIDEOS_TABLE', 'dothethingvideos-metadata')
+ACCOUNTS_TABLE = os.environ.get('ACCOUNTS_TABLE', 'dothething-accounts')
+VIDEOS_BUCKET = os.environ.get('VIDEOS_BUCKET', 'dothethingvideos')
+THUMBNAILS_BUCKET = os.environ.get('THUMBNAILS_BUCKET', 'dothethingthumbnails')
+
+# indexes that sort a code's / an account's clips by timeOfCreation, so feed pages can
+# be read newest-first with Limit/ExclusiveStartKey instead of loading the partition
+VIDEOS_CODE_TIME_INDEX = os.environ.get('VIDEOS_CODE_TIME_INDEX', 'code-timeOfCreation-index')
+VIDEOS_ACCOUNT_TIME_INDEX = os.environ.get('VIDEOS_ACCOUNT_TIME_INDEX', 'accountId-timeOfCreation-index')
+
+# thumbnail batches and homefeed fan-out run concurrently over the shared clients, so their
+# connection pools have to be at least as large as those worker pools
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get('S3_MAX_POOL_CONNECTIONS', '16'))
+DYNAMODB_MAX_POOL_CONNECTIONS = int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', '16'))
+
+# playback URLs are presigned S3 GETs and uploads presigned PUTs, signed locally with the
+# container's cached credentials
+VIDEO_URL_TTL = int(os.environ.get('VIDEO_URL_TTL', '3600'))
+UPLOAD_URL_TTL = int(os.environ.get('UPLOAD_URL_TTL', '3600'))
+
+s3 = aws.Client('s3', max_pool_connections=S3_MAX_POOL_CONNECTIONS)
+videos_table = aws.Table(VIDEOS_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+accounts_table = aws.Table(ACCOUNTS_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+sessions_table = aws.Table(sessions.SESSIONS_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+feed_table = aws.Table(homefeed_index.HOMEFEED_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+codes_table = aws.Table(codes.CODES_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+trending_table = aws.Table(trending.TRENDING_TABLE, max_pool_connections=DYNAMODB_MAX_POOL_CONNECTIONS)
+
+# the trending page is the same for everyone, so each container reads it at most once per
+# TRENDING_CACHE_SECONDS
+TRENDING_CACHE_SECONDS = int(os.environ.get('TRENDING_CACHE_SECONDS', '60'))
+trending_lock = threading.Lock()
+# {'codes': [...], 'fetched_at': epoch seconds}
+cached_trending = None
+
+
+# sessions
+
+# account ID for session_id, or None if it is unknown (cached, see dtt_common.sessions)
+def resolveAccountId(session_id: str):
+    return sessions.resolveAccountId(sessions_table, accounts_table, session_id)
+
+
+def createSession(account_id: str, session_id: str, epoch: int) -> None:
+    sessions.createSession(sessions_table, account_id, session_id, epoch)
+
+
+# accounts
+
+def getInteractions(account_id: str) -> int:
+    return interactions.getInteractions(accounts_table, account_id)
+
+
+# creates the account on its first sign-in and records the login in a single write. The
+# session itself lives in the sessions table (see dtt_common.sessions). The account's
+# sessionId attribute only ever holds a pre-table session, which has no expiry; signing in
+# removes it, as every login used to replace it, so it stops resolving once the account
+# signs in again. With ALL_OLD the response has no Attributes exactly when the account
+# didn't exist before.
+def upsertAccount(account_id: str, epoch: int) -> dict:
+    return accounts_table.update_item(
+        Key={'id': account_id},
+        UpdateExpression='SET timeOfCreation = if_not_exists(timeOfCreation, :t), timeOfLastLogin = :t REMOVE sessionId',
+        ExpressionAttributeValues={':t': epoch},
+        ReturnValues='ALL_OLD')
+
+
+# videos
+
+# one page of clips, newest first, from an index sorted on timeOfCreation (see
+# dtt_common.pagination.queryPage for how page tokens and batch-index are handled)
+def queryVideosPage(index_name: str, key_condition, batch_index: int, page_token: str = None):
+    query_args = {'IndexName': index_name, 'KeyConditionExpression': key_condition, 'ScanIndexForward': False}
+    return queryPage(videos_table, query_args, batch_index, page_token)
+
+
+# a page token is only accepted for the index and partition it was issued for: the key it
+# continues from is the index key (partition_name, timeOfCreation) plus the table key
+# (code, id), and its partition has to be the one being queried. Raises ValueError for
+# anyone else's token, like a malformed one.
+def checkPageToken(page_token: str, partition_name: str, partition_value: str) -> None:
+    start_key = decodePageToken(page_token)
+    if set(start_key) != {partition_name, 'timeOfCreation', 'code', 'id'} or start_key[partition_name] != partition_value:
+        raise ValueError('Invalid page token.')
+
+
+def getAccountVideosPage(account_id: str, batch_index: int, page_token: str = None):
+    if page_token is not None:
+        checkPageToken(page_token, 'accountId', account_id)
+    try:
+        return queryVideosPage(VIDEOS_ACCOUNT_TIME_INDEX, Key('accountId').eq(account_id), batch_index, page_token)
+    except ClientError as err:
+        logger.error(
+            "Couldn't query for videos for account with ID %s. Here's why: %s: %s", account_id,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+
+
+def getCodeVideosPage(code: str, batch_index: int, page_token: str = None):
+    if page_token is not None:
+        checkPageToken(page_token, 'code', code)
+    try:
+        return queryVideosPage(VIDEOS_CODE_TIME_INDEX, Key('code').eq(code), batch_index, page_token)
+    except ClientError as err:
+        logger.error(
+            "Couldn't query for videos with code %s. Here's why: %s: %s", code,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+
+
+# reserves a fresh code for a new thing (see dtt_common.codes)
+def allocateCode(session_id: str) -> str:
+    return codes.allocateCode(codes_table, session_id)
+
+
+def isCodeReserved(code: str) -> bool:
+    return codes.isReserved(codes_table, code)
+
+
+# stores a newly ingested clip, fans it out to the precomputed homefeeds, counts it
+# towards the interactions of every account whose feed it landed in and towards its code's
+# trending score. Retried ingests are expected (a failed record retries its whole event),
+# so the row is only put if the clip isn't there yet; for a clip that is, the stored row is
+# fanned out again (the feed entries are keyed on it, so that only overwrites them) and the
+# counters are left alone. Returns False if the clip had already been stored.
+def addVideo(video: dict) -> bool:
+    try:
+        videos_table.put_item(Item=video, ConditionExpression=Attr('id').not_exists())
+    except ClientError as err:
+        if err.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            logger.error(
+                "Couldn't add video with id %s to table %s. Here's why: %s: %s",
+                video['id'], videos_table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+        logger.info("Video %s was already ingested, only refreshing its homefeed entries", video['id'])
+        stored = videos_table.get_item(Key={'code': video['code'], 'id': video['id']}, ConsistentRead=True)['Item']
+        homefeed_index.addVideoToFeeds(videos_table, feed_table, stored)
+        return False
+    added = homefeed_index.addVideoToFeeds(videos_table, feed_table, video)
+    interactions.addInteractionsForAccounts(accounts_table, added)
+    # trending is best effort: the clip is stored and in its feeds by now, and a retried
+    # ingest finds it stored and wouldn't record it either
+    try:
+        trending.recordClip(trending_table, video, video['timeOfCreation'] / 1000)
+    except Exception as err:
+        logger.warning("Couldn't record video %s for trending, skipping it. Here's why: %r", video['id'], err)
+    return True
+
+
+# the current trending page (see dtt_common.trending), cached per container
+def getTrendingCodes() -> list:
+    global cached_trending
+    cached = cached_trending
+    if cached is not None and time.time() - cached['fetched_at'] < TRENDING_CACHE_SECONDS:
+        return cached['codes']
+    with trending_lock:
+        now = time.time()
+        if cached_trending is None or now - cached_trending['fetched_at'] >= TRENDING_CACHE_SECONDS:
+            cached_trending = {'codes': trending.topCodes(trending_table, now, PAGE_SIZE), 'fetched_at': now}
+        return cached_trending['codes']
+
+
+# S3
+
+# presigned GET for a clip's video
+def videoUrl(video_id: str) -> str:
+    return s3.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={
+            'Bucket': VIDEOS_BUCKET,
+            'Key': video_id
+        },
+        ExpiresIn=VIDEO_URL_TTL
+    )
+
+# presigned upload of a new clip to key: a single PUT URL for one part, otherwise a multipart
+# upload is started and the client gets a PUT URL per part plus URLs to complete it (POST
+# with the CompleteMultipartUpload XML listing each part's ETag) or abort it (DELETE)
+def presignedUpload(key: str, part_count: int):
+    if part_count == 1:
+        return s3.generate_presigned_url(
+            ClientMethod='put_object',
+            Params={
+                'Bucket': VIDEOS_BUCKET,
+                'Key': key
+            },
+            ExpiresIn=UPLOAD_URL_TTL
+        )
+    try:
+        upload_id = s3.create_multipart_upload(Bucket=VIDEOS_BUCKET, Key=key)['UploadId']
+    except ClientError as err:
+        logger.error(
+            "Couldn't start multipart upload of %s. Here's why: %s: %s", key,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    upload_params = {'Bucket': VIDEOS_BUCKET, 'Key': key, 'UploadId': upload_id}
+    return {
+        'key': key,
+        'uploadId': upload_id,
+        'partUrls': [
+            s3.generate_presigned_url(ClientMethod='upload_part', Params=dict(upload_params, PartNumber=part_number), ExpiresIn=UPLOAD_URL_TTL)
+            for part_number in range(1, part_count + 1)
+        ],
+        'completeUrl': s3.generate_presigned_url(ClientMethod='complete_multipart_upload', Params=upload_params, ExpiresIn=UPLOAD_URL_TTL),
+        'abortUrl': s3.generate_presigned_url(ClientMethod='abort_multipart_upload', Params=upload_params, ExpiresIn=UPLOAD_URL_TTL)
+    }
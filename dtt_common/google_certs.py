@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import requests
+from google.auth import jwt
+
+from dtt_common import metrics
+
+logger = logging.getLogger()
+
+# Google ID token verification without a network call per sign-in. Google's signing certs
+# ({key id: PEM}) are fetched over one pooled session and kept in memory for as long as the
+# response's Cache-Control max-age allows (GOOGLE_CERTS_DEFAULT_TTL if it has none), with a
+# copy in GOOGLE_CERTS_CACHE_FILE so a new container in the same sandbox starts warm. A
+# token signed with a key we don't know yet triggers a refresh (Google rotated keys), at
+# most once per GOOGLE_CERTS_MIN_REFRESH_INTERVAL. If Google can't be reached, expired
+# certs are used for up to GOOGLE_CERTS_STALE_TTL more.
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_CERTS_CACHE_FILE = os.environ.get('GOOGLE_CERTS_CACHE_FILE', '/tmp/google-oauth2-certs.json')
+GOOGLE_CERTS_DEFAULT_TTL = int(os.environ.get('GOOGLE_CERTS_DEFAULT_TTL', '300'))
+GOOGLE_CERTS_STALE_TTL = int(os.environ.get('GOOGLE_CERTS_STALE_TTL', '3600'))
+GOOGLE_CERTS_MIN_REFRESH_INTERVAL = int(os.environ.get('GOOGLE_CERTS_MIN_REFRESH_INTERVAL', '60'))
+GOOGLE_CERTS_TIMEOUT = float(os.environ.get('GOOGLE_CERTS_TIMEOUT', '5'))
+GOOGLE_ISSUERS = ['accounts.google.com', 'https://accounts.google.com']
+
+http_session = requests.Session()
+certs_lock = threading.Lock()
+# {'certs': {key id: PEM}, 'fetched_at': epoch seconds, 'expires_at': epoch seconds}
+cached_certs = None
+
+
+def maxAge(cache_control: str) -> int:
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    if match is None:
+        return GOOGLE_CERTS_DEFAULT_TTL
+    return int(match.group(1))
+
+
+def _readCacheFile():
+    try:
+        with open(GOOGLE_CERTS_CACHE_FILE) as f:
+            cached = json.load(f)
+        if isinstance(cached.get('certs'), dict) and isinstance(cached.get('fetched_at'), (int, float)) and isinstance(cached.get('expires_at'), (int, float)):
+            return cached
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _writeCacheFile(cached: dict) -> None:
+    temp_path = '{}.{}'.format(GOOGLE_CERTS_CACHE_FILE, os.getpid())
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(cached, f)
+        os.replace(temp_path, GOOGLE_CERTS_CACHE_FILE)
+    except OSError as err:
+        logger.warning("Couldn't write Google certs to %s. Here's why: %s", GOOGLE_CERTS_CACHE_FILE, err)
+
+
+def _fetchCerts() -> dict:
+    with metrics.timer('google.certs'):
+        response = http_session.get(GOOGLE_CERTS_URL, timeout=GOOGLE_CERTS_TIMEOUT)
+    response.raise_for_status()
+    certs = response.json()
+    if not isinstance(certs, dict) or len(certs) == 0:
+        raise requests.RequestException('No certificates in response from {}'.format(GOOGLE_CERTS_URL))
+    now = time.time()
+    return {'certs': certs, 'fetched_at': now, 'expires_at': now + maxAge(response.headers.get('Cache-Control'))}
+
+
+# {key id: PEM} of Google's current signing certs. refresh fetches them even if the cached
+# ones haven't expired, unless they were fetched within GOOGLE_CERTS_MIN_REFRESH_INTERVAL.
+def getCerts(refresh: bool = False) -> dict:
+    global cached_certs
+    cached = cached_certs
+    if cached is not None and not refresh and cached['expires_at'] > time.time():
+        return cached['certs']
+
+    with certs_lock:
+        now = time.time()
+        if cached_certs is None:
+            cached_certs = _readCacheFile()
+        if cached_certs is not None and cached_certs['expires_at'] > now:
+            if not refresh or now - cached_certs['fetched_at'] < GOOGLE_CERTS_MIN_REFRESH_INTERVAL:
+                return cached_certs['certs']
+        try:
+            cached_certs = _fetchCerts()
+        except requests.RequestException as err:
+            if cached_certs is None or cached_certs['expires_at'] + GOOGLE_CERTS_STALE_TTL < now:
+                logger.error("Couldn't fetch Google certs from %s. Here's why: %s", GOOGLE_CERTS_URL, err)
+                raise
+            logger.warning("Couldn't refresh Google certs from %s, using cached ones. Here's why: %s", GOOGLE_CERTS_URL, err)
+            return cached_certs['certs']
+        _writeCacheFile(cached_certs)
+        return cached_certs['certs']
+
+
+# claims of a valid Google ID token for audience; raises ValueError otherwise, like
+# google.oauth2.id_token.verify_oauth2_token
+def verifyIdToken(token: str, audience: str) -> dict:
+    key_id = jwt.decode_header(token).get('kid')
+    certs = getCerts()
+    if key_id is not None and key_id not in certs:
+        certs = getCerts(refresh=True)
+    claims = jwt.decode(token, certs=certs, audience=audience)
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError('Wrong issuer.')
+    return claims
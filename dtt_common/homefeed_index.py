@@ -0,0 +1,90 @@
+import logging
+import os
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# materialized homefeed: one item per (account, clip) for every clip in every code the
+# account has posted to, keyed so a query on accountId with ScanIndexForward=False reads
+# the feed newest first.
+#   accountId (HASH, S) | feedKey (RANGE, S) = "<timeOfCreation, 13 digits>#<clip id>"
+# plus code, id, timeOfCreation, renditions and hasThumbnail copied from
+# dothethingvideos-metadata
+HOMEFEED_TABLE = os.environ.get('HOMEFEED_TABLE', 'dothething-homefeed')
+
+
+def feedKey(video: dict) -> str:
+    return '{:013d}#{}'.format(int(video['timeOfCreation']), video['id'])
+
+
+def feedEntry(account_id: str, video: dict) -> dict:
+    entry = {
+        'accountId': account_id,
+        'feedKey': feedKey(video),
+        'code': video['code'],
+        'id': video['id'],
+        'timeOfCreation': video['timeOfCreation']
+    }
+    if video.get('renditions'):
+        entry['renditions'] = video['renditions']
+    if 'hasThumbnail' in video:
+        entry['hasThumbnail'] = video['hasThumbnail']
+    return entry
+
+
+# every clip in a code (code, id, timeOfCreation, accountId, renditions and hasThumbnail only).
+# Read consistently (the base table allows it): two accounts posting to a code for the
+# first time at once must each see the other's clip, or each misses it in its feed.
+def getVideosInCode(videos_table, code: str) -> list:
+    query_args = {
+        'KeyConditionExpression': Key('code').eq(code),
+        'ConsistentRead': True,
+        'ProjectionExpression': '#code, id, timeOfCreation, accountId, renditions, hasThumbnail',
+        'ExpressionAttributeNames': {'#code': 'code'}
+    }
+    videos = []
+    try:
+        while True:
+            response = videos_table.query(**query_args)
+            videos.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return videos
+            query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    except ClientError as err:
+        logger.error(
+            "Couldn't query for videos with code %s. Here's why: %s: %s", code,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+
+
+# called at ingest once the clip's metadata row is written: the clip goes into the feed
+# of every account participating in its code, and if this is the uploader's first clip
+# in the code, the code's earlier clips are backfilled into the uploader's feed.
+# Returns how many entries each account's feed gained.
+def addVideoToFeeds(videos_table, feed_table, video: dict) -> dict:
+    code_videos = getVideosInCode(videos_table, video['code'])
+    members = set(item['accountId'] for item in code_videos)
+    members.add(video['accountId'])
+
+    entries = [feedEntry(account_id, video) for account_id in members]
+    uploader_clips = [item for item in code_videos if item['accountId'] == video['accountId']]
+    if all(item['id'] == video['id'] for item in uploader_clips):
+        entries.extend(feedEntry(video['accountId'], item) for item in code_videos if item['id'] != video['id'])
+
+    try:
+        with feed_table.batch_writer(overwrite_by_pkeys=['accountId', 'feedKey']) as batch:
+            for entry in entries:
+                batch.put_item(Item=entry)
+    except ClientError as err:
+        logger.error(
+            "Couldn't add video %s to homefeeds in table %s. Here's why: %s: %s",
+            video['id'], feed_table.name,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    logger.info("Added video %s to %d homefeeds (%d entries)", video['id'], len(members), len(entries))
+    added = {}
+    for entry in entries:
+        added[entry['accountId']] = added.get(entry['accountId'], 0) + 1
+    return added
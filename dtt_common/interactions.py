@@ -0,0 +1,67 @@
+import logging
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# an account's "interactions" is the number of clips in every code it has posted to, i.e.
+# the length of its homefeed. Ingest keeps it current with atomic ADDs, so reading it is a
+# single get_item; tools/reconcile_interactions.py recomputes it in bulk if it drifts.
+
+
+def addInteractions(accounts_table, account_id: str, count: int) -> None:
+    try:
+        accounts_table.update_item(
+            Key={'id': account_id},
+            UpdateExpression="ADD interactions :count",
+            ConditionExpression="attribute_exists(id)",
+            ExpressionAttributeValues={":count": count}
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.warning("Not counting interactions for unknown account_id %s", account_id)
+            return
+        logger.error(
+            "Couldn't add %d interactions for account_id %s. Here's why: %s: %s", count, account_id,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+
+
+# {account_id: count} as returned by homefeed_index.addVideoToFeeds
+def addInteractionsForAccounts(accounts_table, counts: dict) -> None:
+    for account_id, count in counts.items():
+        addInteractions(accounts_table, account_id, count)
+
+
+def getInteractions(accounts_table, account_id: str) -> int:
+    try:
+        response = accounts_table.get_item(
+            Key={'id': account_id},
+            ProjectionExpression="interactions",
+            ConsistentRead=True
+        )
+    except ClientError as err:
+        logger.error(
+            "Couldn't get interactions for account_id %s. Here's why: %s: %s", account_id,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    else:
+        return response.get('Item', {}).get('interactions', 0)
+
+
+def setInteractions(accounts_table, account_id: str, interactions: int) -> None:
+    try:
+        accounts_table.update_item(
+            Key={'id': account_id},
+            UpdateExpression="SET interactions = :interactions",
+            ConditionExpression="attribute_exists(id)",
+            ExpressionAttributeValues={":interactions": interactions}
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            logger.warning("Not setting interactions for unknown account_id %s", account_id)
+            return
+        logger.error(
+            "Couldn't update interactions for account_id %s. Here's why: %s: %s", account_id,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
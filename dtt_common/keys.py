@@ -0,0 +1,67 @@
+import os
+import re
+import uuid
+from collections import namedtuple
+
+from dtt_common import codes, sessions
+
+# S3 keys of uploads in dothethingvideos. The proxy builds them with uploadKey when it hands
+# out an upload URL and ingest reads them back with parseUploadKey, so a key that doesn't
+# parse didn't come from the proxy:
+#   <code>-<upload id>-<session id>.<extension>
+# code: CODE_LENGTH characters of CODE_ALPHABET (dtt_common.codes)
+# upload id: 32 lowercase hex characters (a uuid4)
+# session id: 32 hex characters, or a signed session token (dtt_common.sessions), neither
+#   of which contains '-' or '.'
+# extension: one of UPLOAD_EXTENSIONS, lowercase
+UPLOAD_EXTENSIONS = [extension.strip().lower() for extension in os.environ.get('UPLOAD_EXTENSIONS', 'mp4,mov,m4v,webm,mkv,3gp').split(',') if extension.strip() != '']
+
+UploadKey = namedtuple('UploadKey', ['code', 'upload_id', 'session_id', 'extension'])
+
+_SESSION_ID = '[0-9a-f]{{32}}|{}[A-Za-z0-9_]+_[0-9]+_[0-9a-f]{{32}}'.format(re.escape(sessions.SESSION_TOKEN_PREFIX))
+
+
+# built from dtt_common.codes on each use (re caches the compiled pattern) so the key
+# format follows CODE_ALPHABET and CODE_LENGTH
+def _codePattern() -> str:
+    return '[{}]{{{}}}'.format(re.escape(codes.CODE_ALPHABET), codes.CODE_LENGTH)
+
+
+def _uploadKeyPattern() -> str:
+    return '(?P<code>{})-(?P<upload_id>[0-9a-f]{{32}})-(?P<session_id>{})\\.(?P<extension>[a-z0-9]+)'.format(_codePattern(), _SESSION_ID)
+
+
+def validCode(code: str) -> bool:
+    return re.fullmatch(_codePattern(), code) is not None
+
+
+def validSessionId(session_id: str) -> bool:
+    return re.fullmatch(_SESSION_ID, session_id) is not None
+
+
+# the extension as it goes into the key, from what the client sent ("MP4", ".mov", ...);
+# raises ValueError if uploads of that type aren't accepted
+def uploadExtension(file_extension: str) -> str:
+    extension = file_extension.strip().strip('.').lower()
+    if extension not in UPLOAD_EXTENSIONS:
+        raise ValueError('Unsupported file extension.')
+    return extension
+
+
+# a new upload key; raises ValueError if any part wouldn't parse back
+def uploadKey(code: str, session_id: str, file_extension: str) -> str:
+    if not validCode(code):
+        raise ValueError('Invalid code.')
+    if not validSessionId(session_id):
+        raise ValueError('Invalid session ID.')
+    return '{}-{}-{}.{}'.format(code, uuid.uuid4().hex, session_id, uploadExtension(file_extension))
+
+
+# UploadKey for key; raises ValueError if it isn't exactly what uploadKey makes
+def parseUploadKey(key: str) -> UploadKey:
+    match = re.fullmatch(_uploadKeyPattern(), key)
+    if match is None:
+        raise ValueError('{} is not an upload key'.format(key))
+    if match.group('extension') not in UPLOAD_EXTENSIONS:
+        raise ValueError('{} has an unsupported extension'.format(key))
+    return UploadKey(match.group('code'), match.group('upload_id'), match.group('session_id'), match.group('extension'))
@@ -0,0 +1,121 @@
+import functools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# per-invocation timing in CloudWatch Embedded Metric Format: one JSON line on stdout per
+# sampled invocation, which CloudWatch Logs turns into metrics under METRICS_NAMESPACE
+# with the function and route as dimensions. Every timed operation ("dynamodb.query",
+# "s3.get_object", "ffmpeg", "serialize", ...) reports its total milliseconds and a
+# ".count"; concurrent calls (thumbnail batches, homefeed fan-out) add up, so a total can
+# exceed the invocation's duration. Counters (bytes, items) are reported as they are.
+# Invocations outside the METRICS_SAMPLE_RATE sample skip all of it.
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'DoTheThing')
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', '1'))
+
+_lock = threading.Lock()
+# the invocation being measured, or None; Lambda runs one invocation at a time per container
+# and worker threads report into it
+current = None
+
+
+class Invocation:
+    def __init__(self, function_name: str):
+        self.function_name = function_name
+        self.route = 'none'
+        self.start = time.perf_counter()
+        self.timers = {}
+        self.counters = {}
+
+    def record(self, name: str, milliseconds: float) -> None:
+        with _lock:
+            total, count = self.timers.get(name, (0.0, 0))
+            self.timers[name] = (total + milliseconds, count + 1)
+
+    def add(self, name: str, value) -> None:
+        with _lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def emf(self, status_code) -> dict:
+        metrics = [{'Name': 'duration', 'Unit': 'Milliseconds'}]
+        record = {
+            'function': self.function_name,
+            'route': self.route,
+            'statusCode': status_code,
+            'duration': round((time.perf_counter() - self.start) * 1000, 3)
+        }
+        for name, (total, count) in sorted(self.timers.items()):
+            metrics.append({'Name': name, 'Unit': 'Milliseconds'})
+            metrics.append({'Name': name + '.count', 'Unit': 'Count'})
+            record[name] = round(total, 3)
+            record[name + '.count'] = count
+        for name, value in sorted(self.counters.items()):
+            metrics.append({'Name': name, 'Unit': 'Bytes' if name.endswith('Bytes') else 'Count'})
+            record[name] = value
+        record['_aws'] = {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': METRICS_NAMESPACE,
+                'Dimensions': [['function', 'route']],
+                'Metrics': metrics
+            }]
+        }
+        return record
+
+
+@contextmanager
+def timer(name: str):
+    invocation = current
+    if invocation is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation.record(name, (time.perf_counter() - start) * 1000)
+
+
+def count(name: str, value=1) -> None:
+    invocation = current
+    if invocation is not None:
+        invocation.add(name, value)
+
+
+def setRoute(route: str) -> None:
+    invocation = current
+    if invocation is not None:
+        invocation.route = route
+
+
+def _responseBytes(response) -> int:
+    if not isinstance(response, dict) or not isinstance(response.get('body'), str):
+        return 0
+    return len(response['body'])
+
+
+# wraps a lambda_handler so each sampled invocation emits its metrics record, including
+# invocations that raise (statusCode "error")
+def instrument(function_name: str):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            global current
+            if random.random() >= METRICS_SAMPLE_RATE:
+                current = None
+                return handler(event, context)
+            invocation = current = Invocation(function_name)
+            status_code = 'error'
+            try:
+                response = handler(event, context)
+                status_code = response.get('statusCode', 200) if isinstance(response, dict) else 200
+                invocation.add('responseBytes', _responseBytes(response))
+                return response
+            finally:
+                current = None
+                print(json.dumps(invocation.emf(status_code)))
+        return wrapper
+    return decorator
@@ -0,0 +1,79 @@
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+
+# every feed page holds this many clips
+PAGE_SIZE = 33
+
+
+# opaque continuation token for a DynamoDB LastEvaluatedKey (url-safe, no padding)
+def encodePageToken(last_evaluated_key: dict) -> str:
+    key = {}
+    for name, value in last_evaluated_key.items():
+        if isinstance(value, Decimal):
+            value = {'n': str(value)}
+        key[name] = value
+    raw = json.dumps(key, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+# ExclusiveStartKey for a token made by encodePageToken; raises ValueError if it is malformed
+def decodePageToken(token: str) -> dict:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        key = json.loads(raw)
+    except (ValueError, TypeError) as err:
+        raise ValueError('Invalid page token.') from err
+    if not isinstance(key, dict) or len(key) == 0:
+        raise ValueError('Invalid page token.')
+    for name, value in key.items():
+        if isinstance(value, dict):
+            if set(value) != {'n'}:
+                raise ValueError('Invalid page token.')
+            try:
+                key[name] = Decimal(value['n'])
+            except (InvalidOperation, TypeError) as err:
+                raise ValueError('Invalid page token.') from err
+        elif not isinstance(value, str):
+            raise ValueError('Invalid page token.')
+    return key
+
+
+# skip the first count items of a query without transferring them; returns the key to
+# continue from and whether the query ran out first
+def skipItems(table, query_args: dict, count: int):
+    query_args = dict(query_args)
+    start_key = None
+    while count > 0:
+        if start_key is not None:
+            query_args['ExclusiveStartKey'] = start_key
+        response = table.query(Select='COUNT', Limit=count, **query_args)
+        count -= response['Count']
+        start_key = response.get('LastEvaluatedKey')
+        if start_key is None:
+            return None, True
+    return start_key, False
+
+
+# one page of a query. A page token continues from the previous page; without one,
+# batch_index pages are skipped first (the legacy batch-index header). Returns the items
+# and the token for the next page (None on the last page).
+def queryPage(table, query_args: dict, batch_index: int, page_token: str = None):
+    query_args = dict(query_args)
+    if page_token is not None:
+        start_key = decodePageToken(page_token)
+    else:
+        start_key, exhausted = skipItems(table, query_args, batch_index * PAGE_SIZE)
+        if exhausted:
+            return [], None
+
+    items = []
+    while len(items) < PAGE_SIZE:
+        if start_key is not None:
+            query_args['ExclusiveStartKey'] = start_key
+        response = table.query(Limit=PAGE_SIZE - len(items), **query_args)
+        items.extend(response['Items'])
+        start_key = response.get('LastEvaluatedKey')
+        if start_key is None:
+            break
+    return items, (encodePageToken(start_key) if start_key is not None else None)
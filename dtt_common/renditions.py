@@ -0,0 +1,106 @@
+import logging
+import os
+import subprocess
+import tempfile
+from collections import namedtuple
+
+logger = logging.getLogger()
+
+# thumbnail renditions produced at ingest in a single ffmpeg run. name is also the suffix of
+# the object key in dothethingthumbnails; preview.jpg keeps the legacy "<clip id>.jpg" key so
+# clients and clips from before renditions existed keep working.
+Rendition = namedtuple('Rendition', ['name', 'size', 'width', 'format', 'content_type'])
+
+RENDITIONS = [
+    Rendition('grid.avif', 'grid', 240, 'avif', 'image/avif'),
+    Rendition('grid.webp', 'grid', 240, 'webp', 'image/webp'),
+    Rendition('grid.jpg', 'grid', 240, 'jpg', 'image/jpeg'),
+    Rendition('preview.avif', 'preview', 720, 'avif', 'image/avif'),
+    Rendition('preview.webp', 'preview', 720, 'webp', 'image/webp'),
+    Rendition('preview.jpg', 'preview', 720, 'jpg', 'image/jpeg'),
+]
+RENDITIONS_BY_NAME = {rendition.name: rendition for rendition in RENDITIONS}
+LEGACY_RENDITION = 'preview.jpg'
+
+SIZES = ('grid', 'preview')
+# smallest first at the same dimensions
+FORMATS = ('avif', 'webp', 'jpg')
+
+# ffmpeg output options per format
+ENCODER_OPTIONS = {
+    'avif': ['-c:v', 'libaom-av1', '-still-picture', '1', '-cpu-used', '8', '-crf', '38', '-f', 'avif'],
+    'webp': ['-c:v', 'libwebp', '-quality', '70', '-f', 'webp'],
+    'jpg': ['-c:v', 'mjpeg', '-q:v', '5', '-f', 'image2'],
+}
+
+
+def renditionKey(video_id: str, name: str) -> str:
+    if name == LEGACY_RENDITION:
+        return video_id + '.jpg'
+    return '{}.{}'.format(video_id, name)
+
+
+# ffmpeg arguments that write every rendition of the frame at 1s of source into
+# output_paths ({name: path}) in one decode
+def ffmpegArguments(source: str, output_paths: dict) -> list:
+    names = list(output_paths)
+    branches = ''.join('[r{}]'.format(i) for i in range(len(names)))
+    filters = ['[0:v]split={}{}'.format(len(names), branches)]
+    for i, name in enumerate(names):
+        filters.append("[r{0}]scale='min({1},iw)':-2[o{0}]".format(i, RENDITIONS_BY_NAME[name].width))
+    arguments = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-ss', '00:00:01.000', '-i', source,
+                 '-filter_complex', ';'.join(filters)]
+    for i, name in enumerate(names):
+        arguments += ['-map', '[o{}]'.format(i), '-frames:v', '1'] + ENCODER_OPTIONS[RENDITIONS_BY_NAME[name].format] + [output_paths[name]]
+    return arguments
+
+
+# every rendition of the frame at 1s of source (a path or URL) as {name: bytes}, from a
+# single ffmpeg run. Seeking before -i lets ffmpeg jump there through the container index
+# instead of decoding (and, over HTTP, fetching) everything before it. The outputs are a
+# few KB each, so they go through a scratch directory. If ffmpeg fails part way (say one
+# encoder errors out), whatever it did write is kept; the clip is only listed with those
+# renditions (see chooseRendition). Raises RuntimeError if not even the legacy rendition
+# came out.
+def extract(source: str, timeout: int) -> dict:
+    with tempfile.TemporaryDirectory() as scratch:
+        output_paths = {rendition.name: os.path.join(scratch, rendition.name) for rendition in RENDITIONS}
+        result = subprocess.run(ffmpegArguments(source, output_paths), stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
+        images = {}
+        for name, path in output_paths.items():
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, 'rb') as f:
+                    images[name] = f.read()
+    errors = result.stderr.decode('utf-8', 'replace').strip()
+    if LEGACY_RENDITION not in images:
+        raise RuntimeError("ffmpeg couldn't extract thumbnails from {}: {}".format(source.split('?')[0], errors))
+    if result.returncode != 0:
+        logger.warning(
+            "ffmpeg only extracted %s from %s. Here's why: %s",
+            ', '.join(sorted(images)), source.split('?')[0], errors)
+    return images
+
+
+# (size, formats) the client asked for: "thumbnail-size: grid|preview" and
+# "thumbnail-formats: avif,webp,jpg" (formats it can decode, any order). Defaults to the
+# legacy preview JPEG.
+def requestedRendition(headers: dict) -> tuple:
+    size = headers.get('thumbnail-size', 'preview').lower()
+    if size not in SIZES:
+        size = 'preview'
+    formats = [fmt.strip().lower() for fmt in headers.get('thumbnail-formats', 'jpg').split(',')]
+    formats = [fmt for fmt in FORMATS if fmt in formats] or ['jpg']
+    return size, formats
+
+
+# smallest rendition of video matching the request that was actually produced for it;
+# clips ingested before renditions only have the legacy key
+def chooseRendition(video: dict, size: str, formats: list) -> str:
+    available = video.get('renditions')
+    if not available:
+        return LEGACY_RENDITION
+    for fmt in formats:
+        name = '{}.{}'.format(size, fmt)
+        if name in available:
+            return name
+    return LEGACY_RENDITION
@@ -0,0 +1,94 @@
+import base64
+import gzip
+import os
+
+# brotli is optional like orjson (see dtt_common.serializer); without it "br" is never chosen
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# HTTP plumbing for the API Gateway proxy responses: conditional GETs and compressed bodies.
+# Compressed bodies go back base64 encoded with isBase64Encoded, which API Gateway (REST)
+# only decodes if the API lists the response type in its binary media types ("*/*"), so
+# compression is off until RESPONSE_ENCODINGS names the encodings to offer, most preferred
+# first, e.g. "br,gzip". Bodies under COMPRESSION_MIN_BYTES aren't worth it.
+RESPONSE_ENCODINGS = [encoding.strip() for encoding in os.environ.get('RESPONSE_ENCODINGS', '').split(',') if encoding.strip() != '']
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '5'))
+
+
+# value of a request header regardless of how the client capitalized it
+def header(headers: dict, name: str, default=None):
+    if name in headers:
+        return headers[name]
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return default
+
+
+# True if the client's If-None-Match already has the representation tagged etag (weak
+# comparison, so W/ prefixes don't matter)
+def notModified(headers: dict, etag: str) -> bool:
+    if_none_match = header(headers, 'if-none-match')
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return etag.replace('W/', '', 1) in [tag.replace('W/', '', 1) for tag in tags]
+
+
+# {encoding: q} from Accept-Encoding
+def acceptedEncodings(headers: dict) -> dict:
+    accepted = {}
+    for part in header(headers, 'accept-encoding', '').split(','):
+        fields = part.split(';')
+        name = fields[0].strip().lower()
+        if name == '':
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            field = field.strip()
+            if field.startswith('q='):
+                try:
+                    q = float(field[2:])
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+# the most preferred of RESPONSE_ENCODINGS the client accepts, or None
+def chooseEncoding(headers: dict):
+    accepted = acceptedEncodings(headers)
+    for encoding in RESPONSE_ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if encoding in ('br', 'gzip') and accepted.get(encoding, accepted.get('*', 0.0)) > 0:
+            return encoding
+    return None
+
+
+# compresses response's body in place if the client accepts one of RESPONSE_ENCODINGS
+def compress(response: dict, headers: dict) -> dict:
+    if len(RESPONSE_ENCODINGS) == 0:
+        return response
+    response['headers'] = dict(response.get('headers', {}), Vary='Accept-Encoding')
+    body = response.get('body')
+    if not isinstance(body, str) or len(body) < COMPRESSION_MIN_BYTES:
+        return response
+    encoding = chooseEncoding(headers)
+    if encoding is None:
+        return response
+    if encoding == 'br':
+        compressed = brotli.compress(body.encode('utf-8'), quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body.encode('utf-8'), compresslevel=GZIP_LEVEL, mtime=0)
+    response['body'] = base64.b64encode(compressed).decode('ascii')
+    response['isBase64Encoded'] = True
+    response['headers']['Content-Encoding'] = encoding
+    return response
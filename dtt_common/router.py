@@ -0,0 +1,23 @@
+from collections import namedtuple
+
+# table-driven dispatch for the API Gateway proxy handlers. A handler lists its endpoints
+# as Routes, most specific first, and the first one matching the request handles it:
+# method is the HTTP method, every header in headers must be present and, if any_of isn't
+# empty, at least one of any_of too. handler(headers) returns the response.
+Route = namedtuple('Route', ['name', 'method', 'headers', 'any_of', 'handler'])
+
+
+def matches(route: Route, http_method: str, headers: dict) -> bool:
+    if route.method != http_method:
+        return False
+    if any(header not in headers for header in route.headers):
+        return False
+    return len(route.any_of) == 0 or any(header in headers for header in route.any_of)
+
+
+# first route matching the request, or None
+def match(routes: list, http_method: str, headers: dict):
+    for route in routes:
+        if matches(route, http_method, headers):
+            return route
+    return None
@@ -0,0 +1,248 @@
+import base64
+import hashlib
+import json
+import logging
+import os
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from dtt_common import data, metrics, renditions, responses
+from dtt_common.thumbnail_cache import ThumbnailCache
+
+logger = logging.getLogger()
+
+# turns pages of clip items into what the handlers send back: thumbnails (inline or by URL),
+# optional playback URLs and the JSON body
+
+# orjson encodes pages several times faster than the json module. The proxy and homefeed
+# zips bundle it (build-zip.sh); without it (run locally, say) bodies are the same, just
+# built more slowly
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# thumbnails for a batch are fetched concurrently over the shared S3 client, so
+# S3_MAX_POOL_CONNECTIONS (dtt_common.data) should be at least this large
+THUMBNAIL_FETCH_WORKERS = int(os.environ.get('THUMBNAIL_FETCH_WORKERS', '16'))
+
+# feed pages reference thumbnails by URL unless the client opts into inline base64
+# with the thumbnail-format header; THUMBNAIL_BASE_URL (e.g. a CloudFront origin on
+# the thumbnails bucket) gives stable, cacheable URLs instead of presigned ones
+THUMBNAIL_URL_TTL = int(os.environ.get('THUMBNAIL_URL_TTL', '3600'))
+THUMBNAIL_BASE_URL = os.environ.get('THUMBNAIL_BASE_URL', '').rstrip('/')
+
+# inline thumbnails are served from a per-container LRU (see dtt_common.thumbnail_cache)
+thumbnail_cache = ThumbnailCache(
+    max_bytes=int(os.environ.get('THUMBNAIL_CACHE_BYTES', str(64 * 1024 * 1024))),
+    ttl=float(os.environ.get('THUMBNAIL_CACHE_TTL', '300')),
+    spill_dir=os.environ.get('THUMBNAIL_CACHE_SPILL_DIR', ''),
+    spill_max_bytes=int(os.environ.get('THUMBNAIL_CACHE_SPILL_BYTES', str(256 * 1024 * 1024)))
+)
+placeholder_thumbnail = None
+
+# served for clips whose metadata says they have no thumbnail (hasThumbnail false, set by
+# tools/backfill_thumbnails.py when one can't be made) without trying theirs first
+PLACEHOLDER_THUMBNAIL_KEY = 'obama.jpg'
+
+
+# DynamoDB values the encoders don't know, converted while encoding instead of in a separate
+# pass over the page: numbers come back as Decimal and are emitted as ints when integral
+# (timeOfCreation, counters) and floats otherwise; string and number sets as lists
+def _native(obj):
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=_native).decode('utf-8')
+    return json.dumps(obj, default=_native, separators=(',', ':'), ensure_ascii=False)
+
+
+# placeholder for clips without a thumbnail, downloaded once per container
+def getPlaceholderThumbnail() -> bytes:
+    global placeholder_thumbnail
+    if placeholder_thumbnail is None:
+        placeholder_thumbnail = data.s3.get_object(Bucket=data.THUMBNAILS_BUCKET, Key=PLACEHOLDER_THUMBNAIL_KEY)['Body'].read()
+    return placeholder_thumbnail
+
+
+# get thumbnail bytes by key, falling back to the placeholder if it is missing
+def fetchThumbnail(key: str) -> bytes:
+    if key == PLACEHOLDER_THUMBNAIL_KEY:
+        return getPlaceholderThumbnail()
+    try:
+        return thumbnail_cache.getObject(data.s3, data.THUMBNAILS_BUCKET, key)
+    except:
+        return getPlaceholderThumbnail()
+
+
+# fetch thumbnails for a batch concurrently; results come back in the same order as keys
+def fetchThumbnails(keys: list, max_workers: int = THUMBNAIL_FETCH_WORKERS) -> list:
+    if len(keys) == 0:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return list(executor.map(fetchThumbnail, keys))
+
+
+# URL the client can fetch the thumbnail from directly (CDN or presigned S3 GET)
+def thumbnailUrl(key: str) -> str:
+    if THUMBNAIL_BASE_URL != '':
+        return '{}/{}'.format(THUMBNAIL_BASE_URL, urllib.parse.quote(key))
+    return data.s3.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={
+            'Bucket': data.THUMBNAILS_BUCKET,
+            'Key': key
+        },
+        ExpiresIn=THUMBNAIL_URL_TTL
+    )
+
+
+# clients that still render inline thumbnails send "thumbnail-format: base64"
+def wantsInlineThumbnails(headers: dict) -> bool:
+    return headers.get('thumbnail-format', '').lower() == 'base64'
+
+
+# clients that want playback URLs with the page instead of one DEFCON 1.2 call per clip
+# send "include-video-urls: true"
+def wantsVideoUrls(headers: dict) -> bool:
+    return headers.get('include-video-urls', '').lower() == 'true'
+
+
+# given a page of clips, do all processing needed to get it ready for return
+def processVideos(videos: list, inline_thumbnails: bool = False, rendition: tuple = ('preview', ['jpg']), video_urls: bool = False) -> list:
+    logger.debug("Videos are %s", videos)
+
+    # each clip gets the smallest thumbnail rendition matching the client's thumbnail-size
+    # and thumbnail-formats headers (see dtt_common.renditions), or the placeholder if it
+    # has none
+    thumbnail_keys = []
+    for video in videos:
+        del video['accountId']
+        if video.pop('hasThumbnail', True):
+            name = renditions.chooseRendition(video, *rendition)
+            thumbnail_keys.append(renditions.renditionKey(video['id'], name))
+        else:
+            name = renditions.LEGACY_RENDITION
+            thumbnail_keys.append(PLACEHOLDER_THUMBNAIL_KEY)
+        video.pop('renditions', None)
+        video['thumbnailRendition'] = name
+
+    if inline_thumbnails:
+        thumbnails = fetchThumbnails(thumbnail_keys)
+        for video, thumbnailBytes in zip(videos, thumbnails):
+            video['thumbnailBase64'] = base64.b64encode(thumbnailBytes).decode('utf-8')
+        metrics.count('thumbnailBytes', sum(len(thumbnail) for thumbnail in thumbnails))
+        thumbnail_cache.logStats()
+    else:
+        for video, key in zip(videos, thumbnail_keys):
+            video['thumbnailUrl'] = thumbnailUrl(key)
+    if video_urls:
+        for video in videos:
+            video['videoUrl'] = data.videoUrl(video['id'])
+    return videos
+
+
+# presigned URLs expire, so while a response carries any its tag also changes every half
+# URL lifetime, and a client revalidating with it never keeps URLs that have less than that
+# left; url_ttls are the lifetimes of the URLs in the response
+def _urlWindow(url_ttls: list) -> str:
+    if len(url_ttls) == 0:
+        return ''
+    return str(int(time.time()) // max(min(url_ttls) // 2, 1))
+
+
+# validator for a page, from what is known before any thumbnail or URL work: the clips'
+# ids, timestamps, renditions and thumbnail flags and the headers that shape the response
+def pageETag(videos: list, headers: dict) -> str:
+    inline_thumbnails = wantsInlineThumbnails(headers)
+    video_urls = wantsVideoUrls(headers)
+    digest = hashlib.sha256()
+    for video in videos:
+        digest.update('{}|{}|{}|{}\n'.format(video['id'], video['timeOfCreation'], ','.join(sorted(video.get('renditions', []))), video.get('hasThumbnail', True)).encode('utf-8'))
+    digest.update(repr((inline_thumbnails, renditions.requestedRendition(headers), video_urls)).encode('utf-8'))
+    url_ttls = []
+    if not inline_thumbnails and THUMBNAIL_BASE_URL == '':
+        url_ttls.append(THUMBNAIL_URL_TTL)
+    if video_urls:
+        url_ttls.append(data.VIDEO_URL_TTL)
+    digest.update(_urlWindow(url_ttls).encode('utf-8'))
+    return 'W/"{}"'.format(digest.hexdigest()[:32])
+
+
+# response with one page of clips, prepared for the client as its headers ask, and the
+# token for the next page if there is one. A client that already has the page (If-None-Match)
+# gets a 304 before any thumbnail is fetched or URL signed.
+def videosPageResponse(videos: list, next_page_token: str, headers: dict) -> dict:
+    metrics.count('pageItems', len(videos))
+    etag = pageETag(videos, headers)
+    if responses.notModified(headers, etag):
+        response = {
+            'statusCode': 304,
+            'headers': {'ETag': etag}
+        }
+    else:
+        with metrics.timer('processVideos'):
+            videos = processVideos(videos, wantsInlineThumbnails(headers), renditions.requestedRendition(headers), wantsVideoUrls(headers))
+        with metrics.timer('serialize'):
+            body = dumps(videos)
+        response = {
+            'statusCode': 200,
+            'body': body,
+            'headers': {'ETag': etag}
+        }
+    if next_page_token is not None:
+        response['headers']['next-page-token'] = next_page_token
+    with metrics.timer('compress'):
+        return responses.compress(response, headers)
+
+
+# encoded trending pages by ETag; a few renditions are requested at a time, and the tags
+# (so the entries) all change with the ranking or the URL window
+trending_pages = {}
+
+
+# response with the trending page (data.getTrendingCodes): each code with its decayed score,
+# clip count and a thumbnail URL of its latest clip. The page is the same for everyone, so
+# anything between here and the client may cache it for data.TRENDING_CACHE_SECONDS, and
+# the body is only built (presigning a URL per code) once per tag.
+def trendingResponse(codes: list, headers: dict) -> dict:
+    rendition = renditions.requestedRendition(headers)
+    digest = hashlib.sha256(repr((codes, rendition)).encode('utf-8'))
+    digest.update(_urlWindow([] if THUMBNAIL_BASE_URL != '' else [THUMBNAIL_URL_TTL]).encode('utf-8'))
+    etag = 'W/"{}"'.format(digest.hexdigest()[:32])
+    response_headers = {'ETag': etag, 'Cache-Control': 'public, max-age={}'.format(data.TRENDING_CACHE_SECONDS)}
+    if responses.notModified(headers, etag):
+        return {
+            'statusCode': 304,
+            'headers': response_headers
+        }
+    body = trending_pages.get(etag)
+    if body is None:
+        page = []
+        for code in codes:
+            name = renditions.chooseRendition({'renditions': code['latestRenditions']}, *rendition)
+            page.append({
+                'code': code['code'],
+                'clips': code['clips'],
+                'score': code['score'],
+                'thumbnailRendition': name,
+                'thumbnailUrl': thumbnailUrl(renditions.renditionKey(code['latestId'], name))
+            })
+        body = dumps(page)
+        if len(trending_pages) >= 8:
+            trending_pages.clear()
+        trending_pages[etag] = body
+    response = {
+        'statusCode': 200,
+        'body': body,
+        'headers': response_headers
+    }
+    return responses.compress(response, headers)
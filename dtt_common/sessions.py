@@ -0,0 +1,144 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# session ID -> account ID resolution shared by every handler. Lookups are cached
+# in-process for SESSION_CACHE_TTL seconds, and unknown sessions for
+# SESSION_NEGATIVE_CACHE_TTL seconds, so an expired session can stay valid in another warm
+# container for up to SESSION_CACHE_TTL.
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '60'))
+SESSION_NEGATIVE_CACHE_TTL = float(os.environ.get('SESSION_NEGATIVE_CACHE_TTL', '10'))
+SESSION_CACHE_MAX_ENTRIES = int(os.environ.get('SESSION_CACHE_MAX_ENTRIES', '10000'))
+
+# with a signing key configured, sign-in issues stateless session tokens of the form
+#   v1_<account id>_<expiry, epoch seconds>_<hmac-sha256, 32 hex chars>
+# which resolve without any lookup. They contain no '-' or '.', so they are safe in upload
+# keys. They cannot be revoked before they expire.
+SESSION_SIGNING_KEY = os.environ.get('SESSION_SIGNING_KEY', '')
+SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', str(30 * 24 * 60 * 60)))
+SESSION_TOKEN_PREFIX = 'v1_'
+
+# otherwise sessions are opaque IDs in their own table, one item per session, so signing in
+# on another device adds a session instead of replacing the account's only one. Items expire
+# SESSION_TOKEN_TTL after sign-in (expiresAt is the table's TTL attribute).
+#   sessionId (HASH, S) | accountId | timeOfCreation | expiresAt (epoch seconds)
+# Sessions issued before the table existed only live in the accounts table's sessionId
+# attribute and are still found through its sessionId-index, until the account signs in
+# again: sign-in removes that attribute (see dtt_common.data.upsertAccount) and never writes
+# it, so a table session whose item TTL has deleted stays invalid.
+SESSIONS_TABLE = os.environ.get('SESSIONS_TABLE', 'dothething-sessions')
+
+session_cache = {}
+session_cache_lock = threading.Lock()
+
+
+def signedSessionsEnabled() -> bool:
+    return SESSION_SIGNING_KEY != ''
+
+
+def _sign(payload: str) -> str:
+    return hmac.new(SESSION_SIGNING_KEY.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).hexdigest()[:32]
+
+
+def issueSessionToken(account_id: str) -> str:
+    payload = '{}{}_{}'.format(SESSION_TOKEN_PREFIX, account_id, int(time.time()) + SESSION_TOKEN_TTL)
+    return '{}_{}'.format(payload, _sign(payload))
+
+
+# account ID for a valid, unexpired signed token, otherwise None
+def verifySessionToken(token: str):
+    if not signedSessionsEnabled() or not token.startswith(SESSION_TOKEN_PREFIX):
+        return None
+    try:
+        payload, signature = token.rsplit('_', 1)
+        account_id, expires_at = payload[len(SESSION_TOKEN_PREFIX):].rsplit('_', 1)
+        expires_at = int(expires_at)
+    except ValueError:
+        return None
+    if not hmac.compare_digest(signature, _sign(payload)) or expires_at < time.time() or account_id == '':
+        return None
+    return account_id
+
+
+def _remember(session_id: str, account_id, ttl: float) -> None:
+    with session_cache_lock:
+        if len(session_cache) >= SESSION_CACHE_MAX_ENTRIES:
+            now = time.time()
+            for expired in [key for key, (_, expires_at) in session_cache.items() if expires_at <= now]:
+                del session_cache[expired]
+            if len(session_cache) >= SESSION_CACHE_MAX_ENTRIES:
+                session_cache.clear()
+        session_cache[session_id] = (account_id, time.time() + ttl)
+
+
+# account ID for a pre-sessions-table session, from the accounts table's sessionId-index
+def _resolveLegacySession(accounts_table, session_id: str):
+    try:
+        # query on secondary index session_id
+        response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
+    except ClientError as err:
+        logger.error(
+            "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    if len(response['Items']) == 0:
+        return None
+    return response['Items'][0]['id']
+
+
+# account ID for session_id, or None if it is unknown or expired
+def resolveAccountId(sessions_table, accounts_table, session_id: str):
+    if session_id.startswith(SESSION_TOKEN_PREFIX) and signedSessionsEnabled():
+        return verifySessionToken(session_id)
+
+    with session_cache_lock:
+        cached = session_cache.get(session_id)
+    if cached is not None and cached[1] > time.time():
+        return cached[0]
+
+    try:
+        # consistent, so a session created by a sign-in a moment ago is found (and its miss
+        # isn't negative cached)
+        response = sessions_table.get_item(Key={'sessionId': session_id}, ProjectionExpression='accountId, expiresAt', ConsistentRead=True)
+    except ClientError as err:
+        logger.error(
+            "Couldn't get session %s from table %s. Here's why: %s: %s", session_id, sessions_table.name,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+
+    if 'Item' in response:
+        # TTL deletes lag expiry, so expired items can still be read
+        account_id = response['Item']['accountId'] if response['Item']['expiresAt'] > time.time() else None
+    else:
+        account_id = _resolveLegacySession(accounts_table, session_id)
+
+    if account_id is None:
+        _remember(session_id, None, SESSION_NEGATIVE_CACHE_TTL)
+    else:
+        _remember(session_id, account_id, SESSION_CACHE_TTL)
+    return account_id
+
+
+# called by sign-in: stores a new opaque session for account_id, leaving its other
+# sessions valid, and makes it resolve in this container without a lookup
+def createSession(sessions_table, account_id: str, session_id: str, epoch: int) -> None:
+    try:
+        sessions_table.put_item(Item={
+            'sessionId': session_id,
+            'accountId': account_id,
+            'timeOfCreation': epoch,
+            'expiresAt': epoch // 1000 + SESSION_TOKEN_TTL
+        })
+    except ClientError as err:
+        logger.error(
+            "Couldn't add session for account %s to table %s. Here's why: %s: %s", account_id, sessions_table.name,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    _remember(session_id, account_id, SESSION_CACHE_TTL)
@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# spill files are named <sha1 of the key>-<etag>
+SPILL_FILE_NAME = re.compile('[0-9a-f]{40}-')
+
+
+class CachedThumbnail:
+    __slots__ = ('etag', 'data', 'fetched_at')
+
+    def __init__(self, etag: str, data: bytes, fetched_at: float):
+        self.etag = etag
+        self.data = data
+        self.fetched_at = fetched_at
+
+
+# byte-size-bounded LRU of thumbnail bytes, kept at module level by the handlers so it
+# lives as long as the container. Entries are keyed on the object key and remember the
+# ETag they were fetched with: inside ttl seconds they are served as-is, after that they
+# are revalidated with a conditional GET, so a changed thumbnail is picked up without
+# re-downloading unchanged ones. Entries evicted from memory optionally spill to spill_dir
+# (normally under /tmp) up to spill_max_bytes. The spill is overflow capacity for this
+# cache only: its index is in memory, so it starts empty with the cache, and files left in
+# spill_dir by an earlier instance are removed rather than served.
+class ThumbnailCache:
+
+    def __init__(self, max_bytes: int, ttl: float, spill_dir: str = '', spill_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_max_bytes = spill_max_bytes if spill_dir != '' else 0
+        self.entries = OrderedDict()
+        self.size = 0
+        self.spilled = OrderedDict()
+        self.spill_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.spill_hits = 0
+        self.lock = threading.Lock()
+        if self.spill_max_bytes > 0:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            self._removeStaleSpills()
+
+    # spill files nothing indexes any more would otherwise sit outside spill_max_bytes
+    def _removeStaleSpills(self) -> None:
+        for name in os.listdir(self.spill_dir):
+            if SPILL_FILE_NAME.match(name):
+                try:
+                    os.remove(os.path.join(self.spill_dir, name))
+                except OSError:
+                    pass
+
+    # cached entry for key, or None; promotes spilled entries back into memory
+    def lookup(self, key: str):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry
+            spilled = self.spilled.pop(key, None)
+            if spilled is None:
+                return None
+            etag, path, size, fetched_at = spilled
+            self.spill_size -= size
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.remove(path)
+        except OSError:
+            return None
+        with self.lock:
+            self.spill_hits += 1
+        entry = CachedThumbnail(etag, data, fetched_at)
+        self._insert(key, entry)
+        return entry
+
+    def isFresh(self, entry: CachedThumbnail) -> bool:
+        return time.time() - entry.fetched_at < self.ttl
+
+    def put(self, key: str, etag: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        self._insert(key, CachedThumbnail(etag, data, time.time()))
+
+    def _insert(self, key: str, entry: CachedThumbnail) -> None:
+        evicted = []
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.data)
+            self.entries[key] = entry
+            self.size += len(entry.data)
+            while self.size > self.max_bytes:
+                evicted_key, evicted_entry = self.entries.popitem(last=False)
+                self.size -= len(evicted_entry.data)
+                self.evictions += 1
+                evicted.append((evicted_key, evicted_entry))
+        for evicted_key, evicted_entry in evicted:
+            self._spill(evicted_key, evicted_entry)
+
+    def _spill(self, key: str, entry: CachedThumbnail) -> None:
+        size = len(entry.data)
+        if size > self.spill_max_bytes:
+            return
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        path = os.path.join(self.spill_dir, '{}-{}'.format(digest, entry.etag.strip('"')))
+        try:
+            with open(path, 'wb') as f:
+                f.write(entry.data)
+        except OSError as err:
+            logger.warning("Couldn't spill thumbnail %s to %s: %s", key, path, err)
+            return
+        with self.lock:
+            self.spilled[key] = (entry.etag, path, size, entry.fetched_at)
+            self.spill_size += size
+            while self.spill_size > self.spill_max_bytes:
+                _, (_, old_path, old_size, _) = self.spilled.popitem(last=False)
+                self.spill_size -= old_size
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+
+    # fetch key from bucket through the cache; raises whatever get_object raises on a miss
+    def getObject(self, s3, bucket: str, key: str) -> bytes:
+        entry = self.lookup(key)
+        if entry is not None and self.isFresh(entry):
+            with self.lock:
+                self.hits += 1
+            return entry.data
+        if entry is None:
+            with self.lock:
+                self.misses += 1
+            response = s3.get_object(Bucket=bucket, Key=key)
+        else:
+            with self.lock:
+                self.revalidations += 1
+            try:
+                response = s3.get_object(Bucket=bucket, Key=key, IfNoneMatch=entry.etag)
+            except ClientError as err:
+                if err.response['Error']['Code'] not in ('304', 'NotModified'):
+                    raise
+                entry.fetched_at = time.time()
+                return entry.data
+        data = response['Body'].read()
+        self.put(key, response.get('ETag', ''), data)
+        return data
+
+    def logStats(self) -> None:
+        logger.info(
+            "Thumbnail cache: hits=%d misses=%d revalidations=%d evictions=%d spill_hits=%d entries=%d bytes=%d spilled_bytes=%d",
+            self.hits, self.misses, self.revalidations, self.evictions, self.spill_hits,
+            len(self.entries), self.size, self.spill_size)
@@ -0,0 +1,91 @@
+import logging
+import os
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+
+# "hot codes": codes ranked by how many clips they got recently, newer clips counting more.
+# Rather than decaying every counter as time passes, each clip adds a weight that grows
+# exponentially with its time (2 ** ((t - epoch start) / TRENDING_HALF_LIFE_SECONDS)), which
+# ranks codes exactly as decayed counts would and keeps ingest to atomic ADDs. The weights
+# restart with every epoch so they stay small. Epochs last TRENDING_EPOCH_SECONDS and a new
+# one starts every half epoch, so a clip is added to the two epochs covering its time and
+# the page is read from the older of them, which always has between a half and a whole
+# epoch of history.
+#   epoch (HASH, N) | code (RANGE, S) | score (N) | clips (N) | latestId | latestRenditions | expiresAt (TTL)
+# with a GSI TRENDING_INDEX on epoch (HASH) and score (RANGE), so the page is one query of
+# PAGE_SIZE items however many codes there are.
+TRENDING_TABLE = os.environ.get('TRENDING_TABLE', 'dothething-trending')
+TRENDING_INDEX = os.environ.get('TRENDING_INDEX', 'epoch-score-index')
+TRENDING_EPOCH_SECONDS = int(os.environ.get('TRENDING_EPOCH_SECONDS', str(24 * 3600)))
+TRENDING_HALF_LIFE_SECONDS = int(os.environ.get('TRENDING_HALF_LIFE_SECONDS', str(6 * 3600)))
+
+
+def epochStart(epoch: int) -> float:
+    return epoch * TRENDING_EPOCH_SECONDS / 2
+
+
+# the two epochs covering time t (epoch seconds), older first
+def epochsAt(t: float) -> list:
+    newer = int(t // (TRENDING_EPOCH_SECONDS / 2))
+    return [newer - 1, newer]
+
+
+def readEpoch(t: float) -> int:
+    return epochsAt(t)[0]
+
+
+def weight(t: float, epoch: int) -> float:
+    return 2 ** ((t - epochStart(epoch)) / TRENDING_HALF_LIFE_SECONDS)
+
+
+# called at ingest once the clip is stored; t is its time in epoch seconds
+def recordClip(trending_table, video: dict, t: float) -> None:
+    for epoch in epochsAt(t):
+        try:
+            trending_table.update_item(
+                Key={'epoch': epoch, 'code': video['code']},
+                UpdateExpression='ADD score :weight, clips :one SET latestId = :id, latestRenditions = :renditions, expiresAt = :expires',
+                ExpressionAttributeValues={
+                    ':weight': Decimal(repr(round(weight(t, epoch), 9))),
+                    ':one': 1,
+                    ':id': video['id'],
+                    ':renditions': video.get('renditions', []),
+                    ':expires': int(epochStart(epoch) + 2 * TRENDING_EPOCH_SECONDS)
+                }
+            )
+        except ClientError as err:
+            logger.error(
+                "Couldn't add video %s to trending epoch %d in table %s. Here's why: %s: %s",
+                video['id'], epoch, trending_table.name,
+                err.response['Error']['Code'], err.response['Error']['Message'])
+            raise
+
+
+# the top codes at time t, hottest first: {code, clips, score, latestId, latestRenditions}
+# where score is the code's clip count decayed to t (a clip one half-life old counts 0.5)
+def topCodes(trending_table, t: float, limit: int) -> list:
+    epoch = readEpoch(t)
+    try:
+        response = trending_table.query(
+            IndexName=TRENDING_INDEX,
+            KeyConditionExpression=Key('epoch').eq(epoch),
+            ScanIndexForward=False,
+            Limit=limit
+        )
+    except ClientError as err:
+        logger.error(
+            "Couldn't query trending epoch %d. Here's why: %s: %s", epoch,
+            err.response['Error']['Code'], err.response['Error']['Message'])
+        raise
+    now_weight = weight(t, epoch)
+    return [{
+        'code': item['code'],
+        'clips': int(item['clips']),
+        'score': round(float(item['score']) / now_weight, 3),
+        'latestId': item['latestId'],
+        'latestRenditions': item.get('latestRenditions', [])
+    } for item in response['Items']]
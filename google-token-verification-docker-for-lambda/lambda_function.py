@@ -1,20 +1,19 @@
 import json
 import logging
-from google.oauth2 import id_token
-from google.auth.transport import requests
-import boto3
+import os
 from botocore.exceptions import ClientError
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dtt_common import data, google_certs, metrics, sessions
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-
-dyn = boto3.resource('dynamodb')
-table = dyn.Table('dothething-accounts')
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
+@metrics.instrument('signin')
 def lambda_handler(event, context):
-    logger.info('Request: %s', event)
+    logger.debug('Request: %s', event)
+    metrics.setRoute('signin')
     
     http_method = event.get('httpMethod')
     headers = event.get('headers')
@@ -27,26 +26,29 @@ def lambda_handler(event, context):
                 try:
                     # Specify the CLIENT_ID of the app that accesses the backend:
                     CLIENT_ID = '650326163788-pp25kvcqogpssfp108bln1pnhrunhju8.apps.googleusercontent.com'
-                    idinfo = id_token.verify_oauth2_token(idToken, requests.Request(), CLIENT_ID)
-                        
-                    if idinfo['iss'] not in ['accounts.google.com', 'https://accounts.google.com']:
-                        raise ValueError('Wrong issuer.')
+                    # checked against Google's certs cached in the container (see dtt_common.google_certs)
+                    idinfo = google_certs.verifyIdToken(idToken, CLIENT_ID)
 
                     # ID token is valid. Get the user's Google Account ID from the decoded token.
                     userid = idinfo['sub']
                     logger.info('User ID: %s', userid)
 
-                    # add user to accounts table in dynamodb if not already there
+                    # add user to accounts table in dynamodb if not already there and start a new
+                    # session; the account's other sessions stay valid
                     try:
-                        db_response = table.get_item(Key={'id': userid})
                         epoch = int(time.time() * 1000)
-                        sessionId = uuid.uuid4().hex
-                        if 'Item' not in db_response:
-                            # new account
-                            table.put_item(Item={'id': userid, 'sessionId': sessionId, 'timeOfCreation': epoch, 'timeOfLastLogin': epoch})
+                        if sessions.signedSessionsEnabled():
+                            sessionId = sessions.issueSessionToken(userid)
+                            update_response = data.upsertAccount(userid, epoch)
                         else:
-                            # existing account
-                            table.update_item(Key={'id': userid}, UpdateExpression='SET sessionId = :s, timeOfLastLogin = :t', ExpressionAttributeValues={':s': sessionId, ':t': epoch})
+                            sessionId = uuid.uuid4().hex
+                            # the session item and the account upsert are independent writes
+                            with ThreadPoolExecutor(max_workers=1) as executor:
+                                session_future = executor.submit(data.createSession, userid, sessionId, epoch)
+                                update_response = data.upsertAccount(userid, epoch)
+                                session_future.result()
+                        if 'Attributes' not in update_response:
+                            logger.info('New account: %s', userid)
                     except ClientError as e:
                         logger.error(e.response['Error']['Message'])
                         return {
@@ -89,5 +91,5 @@ def lambda_handler(event, context):
                 'message': 'Method not allowed'
             })
         }
-    print("Response: ", response)
+    logger.debug("Response: %s", response)
     return response
@@ -0,0 +1,16 @@
+# bundle the handler with the shared dtt_common package for a zip deployment, together with
+# the optional accelerators dtt_common picks up when they import: orjson for encoding pages
+# (dtt_common.serializer) and brotli for "br" responses (dtt_common.responses). Without them
+# the function still works, just more slowly. The wheels are for the function's runtime, not
+# this machine: LAMBDA_PLATFORM is manylinux2014_aarch64 for arm64 functions (like the
+# processing center's image) or manylinux2014_x86_64 for x86_64 ones.
+set -e
+LAMBDA_PYTHON_VERSION=${LAMBDA_PYTHON_VERSION:-3.9}
+LAMBDA_PLATFORM=${LAMBDA_PLATFORM:-manylinux2014_aarch64}
+rm -rf dothething-homefeed-handler.zip build
+pip install --target build --platform "$LAMBDA_PLATFORM" --python-version "$LAMBDA_PYTHON_VERSION" \
+    --implementation cp --only-binary=:all: orjson==3.11.5 brotli==1.2.0
+zip -j dothething-homefeed-handler.zip dttHomefeedHandler.py
+(cd build && zip -r ../dothething-homefeed-handler.zip . -x '*__pycache__*' '*.dist-info/*')
+(cd .. && zip -r homefeed-handler/dothething-homefeed-handler.zip dtt_common -x '*__pycache__*')
+rm -rf build
@@ -1,41 +1,52 @@
 import json
+import os
 import logging
-import boto3
 from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
-import base64
-from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+from dtt_common import data, metrics, router, serializer
+from dtt_common.pagination import PAGE_SIZE, decodePageToken, encodePageToken, queryPage
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-s3 = boto3.client('s3')
-dyn = boto3.resource('dynamodb')
-videos_table = dyn.Table('dothethingvideos-metadata')
-accounts_table = dyn.Table('dothething-accounts')
+# the homefeed queries every code the account has posted to; this bounds how many run at once.
+# They share one DynamoDB client, so DYNAMODB_MAX_POOL_CONNECTIONS (dtt_common.data) should
+# be at least this large.
+HOMEFEED_QUERY_WORKERS = int(os.environ.get('HOMEFEED_QUERY_WORKERS', '8'))
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-      if isinstance(obj, Decimal):
-        return str(obj)
-      return json.JSONEncoder.default(self, obj)
+# "index" serves pages from the precomputed feed maintained at ingest (dtt_common.homefeed_index);
+# "live" recomputes them from every code the account has posted to. Switch to "index" once
+# tools/rebuild_homefeed_index.py has backfilled the table.
+HOMEFEED_SOURCE = os.environ.get('HOMEFEED_SOURCE', 'live')
 
+# account ID for session_id, or None if it is unknown (cached, see dtt_common.sessions)
 def getAccountIdFromSessionId(session_id: str) -> str:
-    logger.info("Session ID is %s", session_id)
-    try:
-        response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
-    except ClientError as err:
-        logger.error(
-            "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
-            err.response['Error']['Code'], err.response['Error']['Message'])
-        raise
-    else:
-        account_id = response["Items"][0]["id"]
-        logger.info("Account ID is %s", account_id)
-        return account_id
+    logger.debug("Session ID is %s", session_id)
+    account_id = data.resolveAccountId(session_id)
+    logger.debug("Account ID is %s", account_id)
+    return account_id
+
+# run a query to completion, following LastEvaluatedKey past the 1 MB response limit
+def queryAll(table, **query_args) -> list:
+    items = []
+    while True:
+        response = table.query(**query_args)
+        items.extend(response["Items"])
+        if "LastEvaluatedKey" not in response:
+            return items
+        query_args["ExclusiveStartKey"] = response["LastEvaluatedKey"]
 
 def getCodesForAccount(account_id: str) -> set:
     try:
-        response = videos_table.query(IndexName="accountId-index", KeyConditionExpression="accountId = :accountId", ExpressionAttributeValues={":accountId": account_id})
+        items = queryAll(
+            data.videos_table,
+            IndexName="accountId-index",
+            KeyConditionExpression=Key('accountId').eq(account_id),
+            ProjectionExpression="#code",
+            ExpressionAttributeNames={"#code": "code"}
+        )
     except ClientError as err:
         logger.error(
             "Couldn't query for clips with account_id %s. Here's why: %s: %s", account_id,
@@ -43,111 +54,179 @@ def getCodesForAccount(account_id: str) -> set:
         raise
     else:
         codes = set()
-        for item in response["Items"]:
+        for item in items:
             codes.add(item["code"])
-        logger.info("Codes are %s", codes)
+        logger.debug("Codes are %s", codes)
         return codes
 
-def getVideosForCode(code: str) -> dict:
+# one page of a code's clips, newest first; with a cursor (timeOfCreation, id) the page
+# starts at the cursor's timestamp and iterVideosForCode drops what isn't strictly older
+def queryVideosForCode(code: str, limit: int, cursor: tuple = None, start_key: dict = None) -> dict:
+    key_condition = Key('code').eq(code)
+    if cursor is not None:
+        key_condition = key_condition & Key('timeOfCreation').lte(cursor[0])
+    query_args = {
+        'IndexName': data.VIDEOS_CODE_TIME_INDEX,
+        'KeyConditionExpression': key_condition,
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if start_key is not None:
+        query_args['ExclusiveStartKey'] = start_key
     try:
-        response = videos_table.query(
-            KeyConditionExpression=Key('code').eq(code),
-            ScanIndexForward=True
-        )
+        return data.videos_table.query(**query_args)
     except ClientError as err:
         logger.error(
             "Couldn't query for videos with code %s. Here's why: %s: %s", code,
             err.response['Error']['Code'], err.response['Error']['Message'])
         raise
+
+# a code's clips newest first, starting from an already fetched first page and reading
+# further pages only if the merge consumes that far
+def iterVideosForCode(code: str, response: dict, limit: int, cursor: tuple = None):
+    while True:
+        for video in response['Items']:
+            if cursor is None or (video['timeOfCreation'], video['id']) < cursor:
+                yield video
+        if 'LastEvaluatedKey' not in response:
+            return
+        response = queryVideosForCode(code, limit, cursor, response['LastEvaluatedKey'])
+
+# one homefeed page across all of an account's codes. The first page of every code is
+# queried concurrently and, since each is already newest-first, the pages are k-way
+# merged on (timeOfCreation, id) and consumed only up to the end of the requested page.
+# Returns the page and the token for the next one (None on the last page); raises
+# ValueError for a negative batch_index or a malformed page token.
+def getHomefeedPage(codes: list, batch_index: int, page_token: str = None, max_workers: int = HOMEFEED_QUERY_WORKERS):
+    if batch_index < 0:
+        raise ValueError('Invalid batch index.')
+    if page_token is not None:
+        cursor_key = decodePageToken(page_token)
+        if 'timeOfCreation' not in cursor_key or 'id' not in cursor_key:
+            raise ValueError('Invalid page token.')
+        cursor = (cursor_key['timeOfCreation'], cursor_key['id'])
+        skip = 0
     else:
-        return response["Items"]
-
-def processVideos(videos: dict, batch_index: int) -> dict:
-    videos.sort(key=lambda x: x['timeOfCreation'], reverse=True)
-    start_index = batch_index * 33
-    end_index = start_index + 33
-    videos = videos[start_index:end_index]
-    print("Videos are", videos)
-
-    for video in videos:
-        del video['accountId']
-        try:
-            thumbnailBytes = s3.get_object(Bucket='dothethingthumbnails', Key=video['id'] + '.jpg')['Body'].read()
-        except:
-            thumbnailBytes = s3.get_object(Bucket='dothethingthumbnails', Key="obama.jpg")['Body'].read()
-        video['thumbnailBase64'] = base64.b64encode(thumbnailBytes).decode('utf-8')
-    return videos
-
-def setInteractions(account_id: str, interactions: int) -> None:
+        cursor = None
+        skip = batch_index * PAGE_SIZE
+    needed = skip + PAGE_SIZE
+    if len(codes) == 0:
+        return [], None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(codes))) as executor:
+        responses = list(executor.map(lambda code: queryVideosForCode(code, needed, cursor), codes))
+    merged = heapq.merge(
+        *[iterVideosForCode(code, response, needed, cursor) for code, response in zip(codes, responses)],
+        key=lambda video: (video['timeOfCreation'], video['id']),
+        reverse=True
+    )
+    videos = list(itertools.islice(merged, skip, needed))
+    if len(videos) < PAGE_SIZE:
+        return videos, None
+    last = videos[-1]
+    return videos, encodePageToken({'timeOfCreation': last['timeOfCreation'], 'id': last['id']})
+
+# one homefeed page read straight from the precomputed feed: a single bounded query
+def getIndexedHomefeedPage(account_id: str, batch_index: int, page_token: str = None):
+    if page_token is not None and decodePageToken(page_token).get('accountId') != account_id:
+        raise ValueError('Invalid page token.')
+    query_args = {
+        'KeyConditionExpression': Key('accountId').eq(account_id),
+        'ScanIndexForward': False
+    }
     try:
-        response = accounts_table.update_item(
-            Key={'id': account_id},
-            UpdateExpression="set interactions = :interactions",
-            ExpressionAttributeValues={":interactions": interactions},
-            ReturnValues="UPDATED_NEW"
-        )
+        entries, next_page_token = queryPage(data.feed_table, query_args, batch_index, page_token)
     except ClientError as err:
         logger.error(
-            "Couldn't update interactions for account_id %s. Here's why: %s: %s", account_id,
+            "Couldn't query homefeed for account_id %s. Here's why: %s: %s", account_id,
             err.response['Error']['Code'], err.response['Error']['Message'])
         raise
-    else:
-        logger.info("Successfully updated interactions for account_id %s", account_id)
+    videos = []
+    for entry in entries:
+        video = {'code': entry['code'], 'id': entry['id'], 'timeOfCreation': entry['timeOfCreation'], 'accountId': account_id}
+        if 'renditions' in entry:
+            video['renditions'] = entry['renditions']
+        if 'hasThumbnail' in entry:
+            video['hasThumbnail'] = entry['hasThumbnail']
+        videos.append(video)
+    return videos, next_page_token
+
+def invalidSessionResponse() -> dict:
+    return {
+        "statusCode": 401,
+        "body": json.dumps("Invalid session ID.")
+    }
 
-def getInteractions(account_id: str) -> int:
+# one page of the account's homefeed
+def getHomefeed(headers: dict) -> dict:
+    account_id = getAccountIdFromSessionId(headers["session-id"])
+    if account_id is None:
+        return invalidSessionResponse()
     try:
-        response = accounts_table.query(
-            KeyConditionExpression=Key('id').eq(account_id)
-        )
-    except ClientError as err:
-        logger.error(
-            "Couldn't query for interactions with account_id %s. Here's why: %s: %s", account_id,
-            err.response['Error']['Code'], err.response['Error']['Message'])
-        raise
-    else:
-        return response["Items"][0]["interactions"]
+        if HOMEFEED_SOURCE == "index":
+            videos, next_page_token = getIndexedHomefeedPage(account_id, int(headers.get("batch-index", "0")), headers.get("page-token"))
+        else:
+            codes = getCodesForAccount(account_id)
+            codes = list(codes)
+            videos, next_page_token = getHomefeedPage(codes, int(headers.get("batch-index", "0")), headers.get("page-token"))
+    except ValueError:
+        return {
+            "statusCode": 400,
+            "body": json.dumps("Invalid batch index or page token.")
+        }
+    return serializer.videosPageResponse(videos, next_page_token, headers)
+
+# interactions are kept current at ingest (dtt_common.interactions), so this is one get_item
+def getInteractions(headers: dict) -> dict:
+    account_id = getAccountIdFromSessionId(headers["session-id"])
+    if account_id is None:
+        return invalidSessionResponse()
+    num_interactions = data.getInteractions(account_id)
+    logger.info("Interaction number is %s", num_interactions)
+    return {
+        "statusCode": 200,
+        "body": json.dumps(str(num_interactions))
+    }
 
+# checked in order, first match wins (see dtt_common.router)
+ROUTES = [
+    router.Route("homefeed", "GET", ("session-id",), ("batch-index", "page-token"), getHomefeed),
+    router.Route("interactions", "GET", ("session-id",), (), getInteractions)
+]
+
+@metrics.instrument("homefeed")
 def lambda_handler(event, context):
-    logger.info("Request: %s", event)
+    logger.debug("Request: %s", event)
 
     http_method = event.get('httpMethod')
     headers = event.get('headers')
 
-    if "password" not in headers or headers["password"] != "ThisIsEpicPassword":
+    if http_method == "OPTIONS":
         response = {
-            "statusCode": 401,
-            "body": json.dumps("Invalid credentials.")
-        }
-    
-    elif http_method == "GET" and "session-id" in headers and "batch-index" in headers:
-        account_id = getAccountIdFromSessionId(headers["session-id"])
-        codes = getCodesForAccount(account_id)
-        codes = list(codes)
-        all_videos = []
-        for code in codes:
-            videos = getVideosForCode(code)
-            all_videos.extend(videos)
-        setInteractions(account_id, len(all_videos))
-        all_videos = processVideos(all_videos, int(headers['batch-index']))
-        response = {
-            "statusCode": 200,
-            "body": json.dumps(all_videos, cls=DecimalEncoder)
+            "statusCode": 200
         }
 
-    elif http_method == "GET" and "session-id" in headers:
-        account_id = getAccountIdFromSessionId(headers["session-id"])
-        num_interactions = getInteractions(account_id)
-        logger.info("Interaction number is %s", num_interactions)
+    elif "password" not in headers or headers["password"] != "ThisIsEpicPassword":
         response = {
-            "statusCode": 200,
-            "body": json.dumps(str(num_interactions))
+            "statusCode": 401,
+            "body": json.dumps("Invalid credentials.")
         }
 
     else:
-        response = {
-            "statusCode": 400,
-            "body": json.dumps("Invalid request.")
-        }
+        route = router.match(ROUTES, http_method, headers)
+        if route is None:
+            response = {
+                "statusCode": 400,
+                "body": json.dumps("Invalid request.")
+            }
+        else:
+            metrics.setRoute(route.name)
+            response = route.handler(headers)
 
-    logger.info("Response: %s", response)
+    response["headers"] = dict(response.get("headers", {}), **{
+        "Access-Control-Allow-Headers": "session-id,password,batch-index,page-token,thumbnail-format,thumbnail-size,thumbnail-formats,include-video-urls,if-none-match",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "next-page-token,ETag,Content-Encoding"
+    })
+    logger.debug("Response: %s", response)
     return response
@@ -1,48 +1,199 @@
 import json
+import os
 import logging
-import boto3
-import uuid
-from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
-from decimal import Decimal
-import random
-import base64
+from dtt_common import data, keys, metrics, router, serializer
+from dtt_common.pagination import PAGE_SIZE
 
 print("Loading function")
 
-class DecimalEncoder(json.JSONEncoder):
-    def default(self, obj):
-      if isinstance(obj, Decimal):
-        return str(obj)
-      return json.JSONEncoder.default(self, obj)
-
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+# large uploads can ask for a multipart upload with "part-count: N" (see data.presignedUpload);
+# each part gets its own presigned URL, so this also bounds the response size
+MAX_UPLOAD_PARTS = int(os.environ.get('MAX_UPLOAD_PARTS', '1000'))
+
+# number of parts the client wants to upload in ("part-count", default 1); raises
+# ValueError if it isn't between 1 and MAX_UPLOAD_PARTS
+def uploadPartCount(headers: dict) -> int:
+    part_count = int(headers.get('part-count', '1'))
+    if part_count < 1 or part_count > MAX_UPLOAD_PARTS:
+        raise ValueError('Invalid part count.')
+    return part_count
+
+# body for a presigned upload: the PUT URL itself, or the multipart upload as JSON
+def uploadResponse(upload) -> dict:
+    return {
+        'statusCode': 200,
+        'body': upload if isinstance(upload, str) else json.dumps(upload)
+    }
 
-s3 = boto3.client('s3')
-dyn = boto3.resource('dynamodb')
-videos_table = dyn.Table('dothethingvideos-metadata')
-accounts_table = dyn.Table('dothething-accounts')
+def invalidSessionResponse() -> dict:
+    return {
+        'statusCode': 401,
+        'body': 'Invalid session ID.'
+    }
 
-# given response["Items"], do all processing needed to get it ready for return
-def processVideos(videos: dict, batch_index: int) -> dict:
-    videos.sort(key=lambda x: x['timeOfCreation'], reverse=True)
-    start_index = batch_index * 33
-    end_index = start_index + 33
-    videos = videos[start_index:end_index]
-    print("Videos are", videos)
+# DEFCON 0: get metadata for clips associated with given account
+def getAccountVideos(headers: dict) -> dict:
+    print("Entered DEFCON 0")
+    session_id = headers['session-id']
+    logger.debug("Session ID is %s", session_id)
+
+    # resolve session_id to an account (sessions table, cached per container)
+    account_id = data.resolveAccountId(session_id)
+    if account_id is None:
+        return invalidSessionResponse()
+    logger.debug("Account ID is %s", account_id)
+
+    # query dothethingvideos-metadata for one page of videos for this account
+    try:
+        videos, next_page_token = data.getAccountVideosPage(account_id, int(headers.get('batch-index', '0')), headers.get('page-token'))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': 'Invalid batch index or page token.'
+        }
+    return serializer.videosPageResponse(videos, next_page_token, headers)
+
+def checkSession(headers: dict) -> dict:
+    session_id = headers['session-id']
+    logger.debug("Session ID is %s", session_id)
+    # resolve session_id to an account (sessions table, cached per container)
+    if data.resolveAccountId(session_id) is None:
+        return invalidSessionResponse()
+    return {
+        'statusCode': 200,
+        'body': 'Valid session ID.'
+    }
 
-    for video in videos:
-        del video['accountId']
-        try:
-            thumbnailBytes = s3.get_object(Bucket='dothethingthumbnails', Key=video['id'] + '.jpg')['Body'].read()
-        except:
-            thumbnailBytes = s3.get_object(Bucket='dothethingthumbnails', Key="obama.jpg")['Body'].read()
-        video['thumbnailBase64'] = base64.b64encode(thumbnailBytes).decode('utf-8')
-    return videos
+# DEFCON 1.1: get metadata for existing thing, given code
+def getCodeVideos(headers: dict) -> dict:
+    print("Entered DEFCON 1.1")
+    code = headers['code']
 
+    # use DynamoDB to get one page of "id"s with "code", newest first
+    try:
+        videos, next_page_token = data.getCodeVideosPage(code, int(headers.get('batch-index', '0')), headers.get('page-token'))
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': 'Invalid batch index or page token.'
+        }
+    return serializer.videosPageResponse(videos, next_page_token, headers)
+
+def shareCode(headers: dict) -> dict:
+    code = headers['code']
+    message = "Bruh check out this domino cascade I made. Use code {} and get the app https://thedominoapp.com".format(code)
+    return {
+        'statusCode': 200,
+        'body': json.dumps(message)
+    }
+
+# DEFCON 1.2: get presigned URL given id
+def getVideoUrl(headers: dict) -> dict:
+    print("Entered DEFCON 1.2")
+    return {
+        'statusCode': 200,
+        'body': data.videoUrl(headers['id'])
+    }
+
+# DEFCON 1.3: get presigned URLs for up to a page of clips in one call, given
+# "ids: <id>,<id>,..."; responds with {id: url}
+def getVideoUrls(headers: dict) -> dict:
+    print("Entered DEFCON 1.3")
+    ids = [id.strip() for id in headers['ids'].split(',') if id.strip() != '']
+    if len(ids) == 0 or len(ids) > PAGE_SIZE:
+        return {
+            'statusCode': 400,
+            'body': 'Specify between 1 and {} ids.'.format(PAGE_SIZE)
+        }
+    return {
+        'statusCode': 200,
+        'body': json.dumps({id: data.videoUrl(id) for id in ids})
+    }
+
+# DEFCON 1.4: get the trending codes, hottest first, with a thumbnail of each code's latest clip
+def getTrending(headers: dict) -> dict:
+    print("Entered DEFCON 1.4")
+    return serializer.trendingResponse(data.getTrendingCodes(), headers)
+
+# DEFCON 2.1: upload to existing thing
+def uploadToCode(headers: dict) -> dict:
+    print("Entered DEFCON 2.1")
+    code = headers['code']
+    session_id = headers['session-id']
+
+    # resolve session_id to an account (sessions table, cached per container); upload keys
+    # only take well-formed session IDs (see dtt_common.keys)
+    if not keys.validSessionId(session_id) or data.resolveAccountId(session_id) is None:
+        return invalidSessionResponse()
+    try:
+        part_count = uploadPartCount(headers)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': 'Invalid part count.'
+        }
+    try:
+        key = keys.uploadKey(code, session_id, headers['file-extension'])
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+    # only codes handed out by DEFCON 3.1 (see dtt_common.codes) take uploads, so a clip
+    # can't claim a code that would later be allocated to someone else
+    if not data.isCodeReserved(code):
+        return {
+            'statusCode': 404,
+            'body': 'Unknown code.'
+        }
+    return uploadResponse(data.presignedUpload(key, part_count))
+
+# DEFCON 3.1: create new thing
+def createCode(headers: dict) -> dict:
+    print("Entered DEFCON 3.1")
+    session_id = headers['session-id']
+    # ingest drops uploads from unknown sessions, so they don't get a code or an upload URL
+    if not keys.validSessionId(session_id) or data.resolveAccountId(session_id) is None:
+        return invalidSessionResponse()
+    try:
+        part_count = uploadPartCount(headers)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'body': 'Invalid part count.'
+        }
+    try:
+        file_extension = keys.uploadExtension(headers['file-extension'])
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'body': str(e)
+        }
+    # reserved with a conditional write, so no other creator can get it (see dtt_common.codes)
+    code = data.allocateCode(session_id)
+    key = keys.uploadKey(code, session_id, file_extension)
+    return uploadResponse(data.presignedUpload(key, part_count))
+
+# checked in order, first match wins (see dtt_common.router); a route that needs fewer
+# headers has to come after the ones that need more
+ROUTES = [
+    router.Route('DEFCON 1.4', 'GET', ('trending',), (), getTrending),
+    router.Route('DEFCON 0', 'GET', ('session-id',), ('batch-index', 'page-token'), getAccountVideos),
+    router.Route('session check', 'GET', ('session-id',), (), checkSession),
+    router.Route('DEFCON 1.1', 'GET', ('code',), ('batch-index', 'page-token'), getCodeVideos),
+    router.Route('share message', 'GET', ('code',), (), shareCode),
+    router.Route('DEFCON 1.2', 'GET', ('id',), (), getVideoUrl),
+    router.Route('DEFCON 1.3', 'GET', ('ids',), (), getVideoUrls),
+    router.Route('DEFCON 2.1', 'PUT', ('code', 'file-extension', 'session-id'), (), uploadToCode),
+    router.Route('DEFCON 3.1', 'POST', ('file-extension', 'session-id'), (), createCode)
+]
+
+@metrics.instrument('proxy')
 def lambda_handler(event, context):
-    logger.info('Request: %s', event)
+    logger.debug('Request: %s', event)
     
     http_method = event.get('httpMethod')
     headers = event.get('headers')
@@ -58,208 +209,20 @@ def lambda_handler(event, context):
             'body': 'Invalid credentials.'
         }
 
-    # DEFCON 0: get metadata for clips associated with given account
-    elif http_method == 'GET' and 'session-id' in headers and 'batch-index' in headers:
-
-        print("Entered DEFCON 0")
-        session_id = headers['session-id']
-        print("Session ID is", session_id)
-
-        # query dothething-accounts to get account_id of the account with session_id
-        try:
-            # query on secondary index session_id
-            response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
-        except ClientError as err:
-            logger.error(
-                "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
-                err.response['Error']['Code'], err.response['Error']['Message'])
-            raise
-        else:
-            if len(response['Items']) == 0:
-                response = {
-                    'statusCode': 401,
-                    'body': 'Invalid session ID.'
-                }
-            else:
-                account_id = response['Items'][0]['id']
-                print("Account ID is", account_id)
-
-                # query dothethingvideos-metadata to get all videos for this account
-                try:
-                    # query on secondary index accountId
-                    response = videos_table.query(IndexName="accountId-index", KeyConditionExpression="accountId = :accountId", ExpressionAttributeValues={":accountId": account_id})
-                except ClientError as err:
-                    logger.error(
-                        "Couldn't query for videos for account with ID %s. Here's why: %s: %s", account_id,
-                        err.response['Error']['Code'], err.response['Error']['Message'])
-                    raise
-                else:
-                    videos = processVideos(response['Items'], int(headers['batch-index']))
-                    response = {
-                        'statusCode': 200,
-                        'body': json.dumps(videos, cls=DecimalEncoder)
-                    }
-
-    elif http_method == 'GET' and 'session-id' in headers:
-        session_id = headers['session-id']
-        print("Session ID is", session_id)
-        try:
-            response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
-        except ClientError as err:
-            logger.error(
-                "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
-                err.response['Error']['Code'], err.response['Error']['Message'])
-            raise
-        else:
-            if len(response['Items']) == 0:
-                response = {
-                    'statusCode': 401,
-                    'body': 'Invalid session ID.'
-                }
-            else:
-                response = {
-                    'statusCode': 200,
-                    'body': 'Valid session ID.'
-                }
-    
-    # DEFCON 1.1: get metadata for existing thing, given code
-    elif http_method == 'GET' and 'code' in headers and 'batch-index' in headers:
-        
-        print("Entered DEFCON 1.1")
-        code = headers['code']
-
-        # use DynamoDB to get all "id"s with "code" and sort by "timeOfCreation" in ascending order
-        try:
-            response = videos_table.query(
-                KeyConditionExpression=Key('code').eq(code),
-                ScanIndexForward=True
-            )
-        except ClientError as err:
-            logger.error(
-                "Couldn't query for videos with code %s. Here's why: %s: %s", code,
-                err.response['Error']['Code'], err.response['Error']['Message'])
-            raise
-        else:
-            videos = processVideos(response['Items'], int(headers['batch-index']))
+    else:
+        route = router.match(ROUTES, http_method, headers)
+        if route is None:
             response = {
-                'statusCode': 200,
-                'body': json.dumps(videos, cls=DecimalEncoder)
+                'statusCode': 400,
+                'body': 'Must specify code/file extension/session ID/batch index.'
             }
-
-    elif http_method == 'GET' and 'code' in headers:
-        code = headers['code']
-        message = "Bruh check out this domino cascade I made. Use code {} and get the app https://thedominoapp.com".format(code)
-        response = {
-            'statusCode': 200,
-            'body': json.dumps(message)
-        }
-            
-    # DEFCON 1.2: get presigned URL given id
-    elif http_method == 'GET' and 'id' in headers:
-        
-        print("Entered DEFCON 1.2")
-        id = headers['id']
-        presigned_url = s3.generate_presigned_url(
-            ClientMethod='get_object',
-            Params={
-                'Bucket': 'dothethingvideos',
-                'Key': id
-            }
-        )
-        response = {
-            'statusCode': 200,
-            'body': presigned_url
-        }
-        
-    # DEFCON 2.1: upload to existing thing
-    elif http_method == 'PUT' and 'code' in headers and 'file-extension' in headers and 'session-id' in headers:
-        
-        print("Entered DEFCON 2.1")
-        code = headers['code']
-        session_id = headers['session-id']
-
-        try:
-            # query on secondary index session_id
-            response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
-        except ClientError as err:
-            logger.error(
-                "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
-                err.response['Error']['Code'], err.response['Error']['Message'])
-            raise
         else:
-            if len(response['Items']) == 0:
-                response = {
-                    'statusCode': 401,
-                    'body': 'Invalid session ID.'
-                }
-            else:
-                account_id = response['Items'][0]['id']
-                # check if a video exists with this code (primary key)
-                try:
-                    response = videos_table.query(KeyConditionExpression=Key('code').eq(code))
-                except ClientError as err:
-                    logger.error(
-                        "Couldn't query for videos with code %s and account_id %s. Here's why: %s: %s", code, account_id,
-                        err.response['Error']['Code'], err.response['Error']['Message'])
-                    raise
-                else:
-                    file_extension = headers['file-extension'].strip('.').lower()
-                    key = '{}-{}-{}.{}'.format(code, uuid.uuid4().hex, session_id, file_extension)
-                    presigned_url = s3.generate_presigned_url(
-                        ClientMethod='put_object',
-                        Params={
-                            'Bucket': 'dothethingvideos',
-                            'Key': key
-                        }
-                    )
-                    response = {
-                        'statusCode': 200,
-                        'body': presigned_url
-                    }
-        
-    # DEFCON 3.1: create new thing
-    elif http_method == 'POST' and 'file-extension' in headers and 'session-id' in headers:
-        
-        def generateCode():
-            code = ''.join(random.choice("123456789abcdefABCDEF") for _ in range(8))
-            try:
-                response = videos_table.query(KeyConditionExpression=Key('code').eq(code))
-            except ClientError as err:
-                logger.error(
-                    "Couldn't query for videos with code %s. Here's why: %s: %s", code,
-                    err.response['Error']['Code'], err.response['Error']['Message'])
-                raise
-            else:
-                if len(response["Items"]) == 0:
-                    return code
-                else:
-                    return generateCode()
-        
-        print("Entered DEFCON 3.1")
-        file_extension = headers['file-extension'].strip('.').lower()
-        session_id = headers['session-id']
-        code = generateCode()
-        key = '{}-{}-{}.{}'.format(code, uuid.uuid4().hex, session_id, file_extension)
-        presigned_url = s3.generate_presigned_url(
-            ClientMethod='put_object',
-            Params={
-                'Bucket': 'dothethingvideos',
-                'Key': key
-            }
-        )
-        response = {
-            'statusCode': 200,
-            'body': presigned_url
-        }
-        
-    else:
-        response = {
-            'statusCode': 400,
-            'body': 'Must specify code/file extension/session ID/batch index.'
-        }
+            metrics.setRoute(route.name)
+            response = route.handler(headers)
     
-    response['headers'] = {
-        "Access-Control-Allow-Headers": "code,password,batch-index",
-        "Access-Control-Allow-Origin": "*"
-    }
+    response['headers'] = dict(response.get('headers', {}), **{
+        "Access-Control-Allow-Headers": "code,password,batch-index,page-token,thumbnail-format,thumbnail-size,thumbnail-formats,include-video-urls,ids,part-count,if-none-match,trending",
+        "Access-Control-Allow-Origin": "*",
+        "Access-Control-Expose-Headers": "next-page-token,ETag,Content-Encoding"
+    })
     return response
@@ -0,0 +1,90 @@
+"""Reserve every existing code in the codes table (dtt_common.codes).
+
+    python tools/backfill_codes.py [--segments 8] [--dry-run]
+
+The proxy hands out new codes by reserving them in dothething-codes with a conditional
+put. Codes created before that table existed only appear in dothethingvideos-metadata, so
+run this once before deploying the allocator, otherwise a new thing could be given the
+code of an old one. Each code is reserved with the time of its earliest clip. Safe to
+rerun: codes that are already reserved are left alone.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtt_common import codes  # noqa: E402
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+dyn = boto3.resource('dynamodb')
+videos_table = dyn.Table('dothethingvideos-metadata')
+codes_table = dyn.Table(codes.CODES_TABLE)
+
+
+def scanSegment(segment: int, total_segments: int) -> list:
+    scan_args = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': '#code, timeOfCreation',
+        'ExpressionAttributeNames': {'#code': 'code'}
+    }
+    items = []
+    while True:
+        response = videos_table.scan(**scan_args)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+# {code: time of its earliest clip}
+def existingCodes(total_segments: int) -> dict:
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = executor.map(lambda segment: scanSegment(segment, total_segments), range(total_segments))
+    first_seen = {}
+    for items in segments:
+        for item in items:
+            first_seen[item['code']] = min(first_seen.get(item['code'], item['timeOfCreation']), item['timeOfCreation'])
+    return first_seen
+
+
+# True if the code was reserved now, False if it already was
+def reserveCode(code: str, time_of_creation) -> bool:
+    try:
+        codes_table.put_item(
+            Item={'code': code, 'timeOfCreation': time_of_creation},
+            ConditionExpression=Attr('code').not_exists()
+        )
+    except ClientError as err:
+        if err.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    first_seen = existingCodes(args.segments)
+    logger.info("Found %d codes in dothethingvideos-metadata", len(first_seen))
+    if args.dry_run:
+        return
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        reserved = sum(executor.map(lambda code: reserveCode(code, first_seen[code]), first_seen))
+    logger.info("Reserved %d codes, %d were already reserved", reserved, len(first_seen) - reserved)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""Find clips missing thumbnails or metadata and regenerate them (dtt_common.renditions).
+
+    python tools/backfill_thumbnails.py [--segments 16] [--workers 4] [--checkpoint DIR]
+                                        [--rescan] [--retry-failed] [--legacy] [--dry-run]
+
+Lists dothethingvideos and dothethingthumbnails (one key range per leading character, in
+parallel) while scanning dothethingvideos-metadata with a parallel scan, then works
+through what is missing:
+
+- clips whose thumbnails aren't all in the bucket (for clips from before renditions, no
+  <id>.jpg) get every rendition extracted again with the same single ffmpeg run as
+  ingest; the item's renditions are updated. With --legacy, clips that only have the
+  legacy JPEG are reprocessed too.
+- uploads without a metadata row (ingest failed after the upload) are ingested the way
+  the processing center would, timed at the upload's LastModified: renditions, then the
+  row, homefeeds, interactions and trending through dtt_common.data. Uploads younger than
+  --min-age may still be in ingest and are left alone, as are uploads whose session no
+  longer resolves to an account.
+- clips with metadata but no upload, or an upload ffmpeg can't read, get hasThumbnail
+  false, so the read paths serve the placeholder without trying a GET for theirs.
+
+Clips whose item changed are rewritten in the precomputed homefeed of every member of
+their code (dtt_common.homefeed_index).
+
+The work list is saved to inventory.json in the checkpoint directory and every finished
+clip is appended to progress.jsonl, so an interrupted run picks up where it stopped
+without listing everything again; pass --rescan to take a fresh inventory. Clips that
+failed are only retried with --retry-failed. Each worker runs one ffmpeg at a time.
+"""
+import argparse
+import json
+import logging
+import os
+import string
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from boto3.dynamodb.conditions import Attr
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtt_common import data, homefeed_index, keys, renditions  # noqa: E402
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+# ffmpeg reads uploads over presigned URLs, as in the processing center
+FFMPEG_URL_TTL = 900
+
+# keys start with a code or a legacy alphanumeric id, so a bucket is listed as one range
+# per leading character, all at once
+KEY_SPLITS = sorted(string.digits + string.ascii_letters)
+
+
+# {key: LastModified in ms} for the keys strictly between start_after and stop_before
+def listRange(bucket: str, start_after: str = None, stop_before: str = None) -> dict:
+    list_args = {'Bucket': bucket}
+    if start_after is not None:
+        list_args['StartAfter'] = start_after
+    objects = {}
+    while True:
+        response = data.s3.list_objects_v2(**list_args)
+        for obj in response.get('Contents', []):
+            if stop_before is not None and obj['Key'] >= stop_before:
+                return objects
+            objects[obj['Key']] = int(obj['LastModified'].timestamp() * 1000)
+        if not response.get('IsTruncated'):
+            return objects
+        list_args['ContinuationToken'] = response['NextContinuationToken']
+
+
+def listBucket(bucket: str, workers: int) -> dict:
+    bounds = [None] + KEY_SPLITS + [None]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        shards = executor.map(lambda bound: listRange(bucket, *bound), zip(bounds[:-1], bounds[1:]))
+    return {key: modified for shard in shards for key, modified in shard.items()}
+
+
+def scanVideos(total_segments: int) -> list:
+    def scanSegment(segment):
+        scan_args = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'ProjectionExpression': '#code, id, timeOfCreation, accountId, renditions, hasThumbnail',
+            'ExpressionAttributeNames': {'#code': 'code'}
+        }
+        items = []
+        while True:
+            response = data.videos_table.scan(**scan_args)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        return [item for items in executor.map(scanSegment, range(total_segments)) for item in items]
+
+
+def clip(item: dict) -> dict:
+    return {
+        'code': item['code'],
+        'id': item['id'],
+        'timeOfCreation': int(item['timeOfCreation']),
+        'accountId': item['accountId'],
+        'renditions': sorted(item.get('renditions', []))
+    }
+
+
+# the work list ({'action': 'renditions' | 'ingest' | 'no-thumbnail', 'video': ...}) and
+# each code's members, from the buckets and the metadata table
+def takeInventory(args) -> dict:
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        uploads = executor.submit(listBucket, data.VIDEOS_BUCKET, args.segments)
+        thumbnails = executor.submit(listBucket, data.THUMBNAILS_BUCKET, args.segments)
+        items = executor.submit(scanVideos, args.segments)
+        uploads, thumbnails, items = uploads.result(), thumbnails.result(), items.result()
+    logger.info("Listed %d uploads and %d thumbnails, scanned %d videos", len(uploads), len(thumbnails), len(items))
+
+    tasks = []
+    members = {}
+    for item in items:
+        members.setdefault(item['code'], set()).add(item['accountId'])
+        if item.get('hasThumbnail', True) is False:
+            continue
+        names = item.get('renditions') or [renditions.LEGACY_RENDITION]
+        complete = all(renditions.renditionKey(item['id'], name) in thumbnails for name in names)
+        if not complete or (args.legacy and not item.get('renditions')):
+            tasks.append({'action': 'renditions' if item['id'] in uploads else 'no-thumbnail', 'video': clip(item)})
+
+    known = set(item['id'] for item in items)
+    cutoff = int((time.time() - args.min_age) * 1000)
+    for key, modified in sorted(uploads.items()):
+        if key not in known and modified < cutoff:
+            tasks.append({'action': 'ingest', 'video': {'id': key, 'timeOfCreation': modified}})
+    return {'tasks': tasks, 'members': {code: sorted(accounts) for code, accounts in members.items()}}
+
+
+def extract(key: str, timeout: int) -> dict:
+    url = data.s3.generate_presigned_url(
+        ClientMethod='get_object',
+        Params={'Bucket': data.VIDEOS_BUCKET, 'Key': key},
+        ExpiresIn=FFMPEG_URL_TTL
+    )
+    images = renditions.extract(url, timeout)
+    for name, image in images.items():
+        data.s3.put_object(
+            Bucket=data.THUMBNAILS_BUCKET,
+            Key=renditions.renditionKey(key, name),
+            Body=image,
+            ContentType=renditions.RENDITIONS_BY_NAME[name].content_type,
+            CacheControl='public, max-age=31536000, immutable'
+        )
+    return images
+
+
+# SETs the clip's renditions (and clears hasThumbnail) or, with names None, marks it as
+# having no thumbnail; then rewrites its homefeed entries
+def updateVideo(video: dict, names: list, members: dict) -> None:
+    if names is None:
+        update_args = {'UpdateExpression': 'SET hasThumbnail = :no', 'ExpressionAttributeValues': {':no': False}}
+        video = dict(video, hasThumbnail=False)
+    else:
+        update_args = {'UpdateExpression': 'SET renditions = :renditions REMOVE hasThumbnail', 'ExpressionAttributeValues': {':renditions': names}}
+        video = dict(video, renditions=names)
+    data.videos_table.update_item(
+        Key={'code': video['code'], 'id': video['id']},
+        ConditionExpression=Attr('id').exists(),
+        **update_args
+    )
+    with data.feed_table.batch_writer(overwrite_by_pkeys=['accountId', 'feedKey']) as batch:
+        for account_id in members.get(video['code'], []):
+            batch.put_item(Item=homefeed_index.feedEntry(account_id, video))
+
+
+def ingest(video: dict, timeout: int) -> str:
+    upload_key = keys.parseUploadKey(video['id'])
+    account_id = data.resolveAccountId(upload_key.session_id)
+    if account_id is None:
+        raise ValueError('no account with session ID {}'.format(upload_key.session_id))
+    images = extract(video['id'], timeout)
+    data.addVideo({
+        'code': upload_key.code,
+        'id': video['id'],
+        'timeOfCreation': video['timeOfCreation'],
+        'accountId': account_id,
+        'renditions': sorted(images)
+    })
+    return 'ingested'
+
+
+# one clip of the work list; returns its progress record
+def runTask(task: dict, members: dict, timeout: int) -> dict:
+    video = task['video']
+    try:
+        if task['action'] == 'ingest':
+            result = ingest(video, timeout)
+        elif task['action'] == 'no-thumbnail':
+            updateVideo(video, None, members)
+            result = 'no-thumbnail'
+        else:
+            try:
+                images = extract(video['id'], timeout)
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                logger.info("Clip %s has no usable upload: %s", video['id'], e)
+                updateVideo(video, None, members)
+                return {'id': video['id'], 'result': 'no-thumbnail'}
+            updateVideo(video, sorted(images), members)
+            result = 'fixed'
+    except Exception as e:
+        logger.error("Couldn't %s %s: %s", task['action'], video['id'], e)
+        return {'id': video['id'], 'result': 'failed', 'error': str(e)}
+    return {'id': video['id'], 'result': result}
+
+
+def loadInventory(path: str):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def saveInventory(path: str, inventory: dict) -> None:
+    with open(path + '.tmp', 'w') as f:
+        json.dump(inventory, f)
+    os.replace(path + '.tmp', path)
+
+
+# {id: result} for the clips already done; a line cut short by an interrupted run is ignored
+def loadProgress(path: str) -> dict:
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            done[record['id']] = record['result']
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=16, help='parallel scan segments and concurrent bucket listings')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='clips processed at a time (one ffmpeg each)')
+    parser.add_argument('--checkpoint', default='backfill_thumbnails.checkpoint', help='directory for the inventory and progress')
+    parser.add_argument('--rescan', action='store_true', help='take a fresh inventory instead of resuming')
+    parser.add_argument('--retry-failed', action='store_true')
+    parser.add_argument('--legacy', action='store_true', help='also reprocess clips that only have the legacy JPEG')
+    parser.add_argument('--min-age', type=int, default=3600, help='seconds before an upload without metadata counts as lost')
+    parser.add_argument('--ffmpeg-timeout', type=int, default=120)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    inventory_path = os.path.join(args.checkpoint, 'inventory.json')
+    progress_path = os.path.join(args.checkpoint, 'progress.jsonl')
+    inventory = None if args.rescan or args.dry_run else loadInventory(inventory_path)
+    done = {}
+    if inventory is None:
+        inventory = takeInventory(args)
+        if not args.dry_run:
+            os.makedirs(args.checkpoint, exist_ok=True)
+            saveInventory(inventory_path, inventory)
+            if os.path.exists(progress_path):
+                os.remove(progress_path)
+    else:
+        logger.info("Resuming from %s", inventory_path)
+        done = loadProgress(progress_path)
+    tasks = [task for task in inventory['tasks'] if task['video']['id'] not in done or (args.retry_failed and done[task['video']['id']] == 'failed')]
+    actions = {}
+    for task in tasks:
+        actions[task['action']] = actions.get(task['action'], 0) + 1
+    logger.info("%d clips to do (%s), %d already done", len(tasks), ", ".join("{} {}".format(count, action) for action, count in sorted(actions.items())) or "nothing", len(inventory['tasks']) - len(tasks))
+    if args.dry_run or len(tasks) == 0:
+        return
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, open(progress_path, 'a') as progress:
+        futures = [executor.submit(runTask, task, inventory['members'], args.ffmpeg_timeout) for task in tasks]
+        for i, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            progress.write(json.dumps(record) + '\n')
+            progress.flush()
+            results[record['result']] = results.get(record['result'], 0) + 1
+            if i % 100 == 0:
+                logger.info("%d of %d clips done", i, len(tasks))
+    logger.info("Done: %s", ", ".join("{} {}".format(count, result) for result, count in sorted(results.items())))
+    if results.get('failed'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
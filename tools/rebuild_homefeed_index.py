@@ -0,0 +1,170 @@
+"""Backfill and check the precomputed homefeed table (dtt_common.homefeed_index).
+
+    python tools/rebuild_homefeed_index.py rebuild [--segments 8]
+    python tools/rebuild_homefeed_index.py check [--account ID ...] [--repair]
+
+rebuild scans dothethingvideos-metadata with a parallel scan and writes a feed entry for
+every (account, clip) pair where the account has posted to the clip's code. Entries are
+idempotent, so it is safe to run while ingest keeps writing.
+
+check recomputes each account's homefeed the way the live homefeed handler does
+(accountId-index -> codes -> clips per code) and diffs it against the index; with
+--repair missing entries are written and stale ones deleted.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from boto3.dynamodb.conditions import Key
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtt_common import homefeed_index  # noqa: E402
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+dyn = boto3.resource('dynamodb')
+videos_table = dyn.Table('dothethingvideos-metadata')
+feed_table = dyn.Table(homefeed_index.HOMEFEED_TABLE)
+
+
+def scanSegment(segment: int, total_segments: int) -> list:
+    scan_args = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': '#code, id, timeOfCreation, accountId, renditions, hasThumbnail',
+        'ExpressionAttributeNames': {'#code': 'code'}
+    }
+    items = []
+    while True:
+        response = videos_table.scan(**scan_args)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def scanVideos(total_segments: int) -> list:
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        segments = executor.map(lambda segment: scanSegment(segment, total_segments), range(total_segments))
+    return [item for items in segments for item in items]
+
+
+# {account_id: {feedKey: entry}} for the given clips
+def expectedFeeds(videos: list) -> dict:
+    by_code = {}
+    for video in videos:
+        by_code.setdefault(video['code'], []).append(video)
+    feeds = {}
+    for code_videos in by_code.values():
+        members = set(video['accountId'] for video in code_videos)
+        for account_id in members:
+            feed = feeds.setdefault(account_id, {})
+            for video in code_videos:
+                entry = homefeed_index.feedEntry(account_id, video)
+                feed[entry['feedKey']] = entry
+    return feeds
+
+
+def writeEntries(entries) -> int:
+    count = 0
+    with feed_table.batch_writer(overwrite_by_pkeys=['accountId', 'feedKey']) as batch:
+        for entry in entries:
+            batch.put_item(Item=entry)
+            count += 1
+    return count
+
+
+def rebuild(args) -> None:
+    videos = scanVideos(args.segments)
+    logger.info("Scanned %d videos", len(videos))
+    feeds = expectedFeeds(videos)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        written = sum(executor.map(lambda feed: writeEntries(feed.values()), feeds.values()))
+    logger.info("Wrote %d feed entries for %d accounts", written, len(feeds))
+
+
+# the homefeed exactly as the live handler computes it
+def liveFeed(account_id: str) -> dict:
+    query_args = {
+        'IndexName': 'accountId-index',
+        'KeyConditionExpression': Key('accountId').eq(account_id),
+        'ProjectionExpression': '#code',
+        'ExpressionAttributeNames': {'#code': 'code'}
+    }
+    codes = set()
+    while True:
+        response = videos_table.query(**query_args)
+        codes.update(item['code'] for item in response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    feed = {}
+    for code in codes:
+        for video in homefeed_index.getVideosInCode(videos_table, code):
+            entry = homefeed_index.feedEntry(account_id, video)
+            feed[entry['feedKey']] = entry
+    return feed
+
+
+def indexedFeed(account_id: str) -> dict:
+    query_args = {'KeyConditionExpression': Key('accountId').eq(account_id)}
+    feed = {}
+    while True:
+        response = feed_table.query(**query_args)
+        for entry in response['Items']:
+            feed[entry['feedKey']] = entry
+        if 'LastEvaluatedKey' not in response:
+            return feed
+        query_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def checkAccount(account_id: str, repair: bool) -> bool:
+    live = liveFeed(account_id)
+    indexed = indexedFeed(account_id)
+    missing = [live[key] for key in live.keys() - indexed.keys()]
+    stale = sorted(indexed.keys() - live.keys())
+    if len(missing) == 0 and len(stale) == 0:
+        return True
+    logger.info("Account %s: %d live, %d indexed, %d missing, %d stale", account_id, len(live), len(indexed), len(missing), len(stale))
+    if repair:
+        writeEntries(missing)
+        with feed_table.batch_writer() as batch:
+            for key in stale:
+                batch.delete_item(Key={'accountId': account_id, 'feedKey': key})
+    return False
+
+
+def check(args) -> None:
+    accounts = args.account
+    if not accounts:
+        accounts = sorted(set(video['accountId'] for video in scanVideos(args.segments)))
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(lambda account_id: checkAccount(account_id, args.repair), accounts))
+    inconsistent = results.count(False)
+    logger.info("Checked %d accounts, %d inconsistent%s", len(accounts), inconsistent, " (repaired)" if args.repair and inconsistent else "")
+    if inconsistent and not args.repair:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments')
+    parser.add_argument('--workers', type=int, default=8)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild')
+    check_parser = commands.add_parser('check')
+    check_parser.add_argument('--account', action='append', help='account to check (default: every account with clips)')
+    check_parser.add_argument('--repair', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'rebuild':
+        rebuild(args)
+    else:
+        check(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Recompute every account's interactions count in bulk (dtt_common.interactions).
+
+    python tools/reconcile_interactions.py [--segments 8] [--dry-run]
+
+Ingest maintains interactions with atomic ADDs; a retried ingest can count a clip twice
+and accounts created before the counter existed have no value at all. This scans
+dothethingvideos-metadata and dothething-accounts in parallel, recomputes each account's
+count (clips in every code it has posted to, i.e. its homefeed length) and SETs the ones
+that differ. A clip ingested while this runs may be counted once more or once less than
+it should; rerun to settle.
+"""
+import argparse
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dtt_common import interactions  # noqa: E402
+
+logger = logging.getLogger()
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+dyn = boto3.resource('dynamodb')
+videos_table = dyn.Table('dothethingvideos-metadata')
+accounts_table = dyn.Table('dothething-accounts')
+
+
+def scanTable(table, total_segments: int, projection: str, names: dict = None) -> list:
+    def scanSegment(segment):
+        scan_args = {'Segment': segment, 'TotalSegments': total_segments, 'ProjectionExpression': projection}
+        if names:
+            scan_args['ExpressionAttributeNames'] = names
+        items = []
+        while True:
+            response = table.scan(**scan_args)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            scan_args['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with ThreadPoolExecutor(max_workers=total_segments) as executor:
+        return [item for items in executor.map(scanSegment, range(total_segments)) for item in items]
+
+
+# {account_id: interactions} recomputed from the clips
+def expectedInteractions(videos: list) -> dict:
+    clips_per_code = {}
+    codes_per_account = {}
+    for video in videos:
+        clips_per_code[video['code']] = clips_per_code.get(video['code'], 0) + 1
+        codes_per_account.setdefault(video['accountId'], set()).add(video['code'])
+    return {
+        account_id: sum(clips_per_code[code] for code in codes)
+        for account_id, codes in codes_per_account.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, default=8, help='parallel scan segments per table')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        videos = executor.submit(scanTable, videos_table, args.segments, '#code, accountId', {'#code': 'code'})
+        accounts = executor.submit(scanTable, accounts_table, args.segments, 'id, interactions')
+        videos, accounts = videos.result(), accounts.result()
+    logger.info("Scanned %d videos and %d accounts", len(videos), len(accounts))
+
+    expected = expectedInteractions(videos)
+    updates = []
+    for account in accounts:
+        count = expected.get(account['id'], 0)
+        if account.get('interactions') != count:
+            updates.append((account['id'], count))
+            logger.info("Account %s: %s -> %d", account['id'], account.get('interactions'), count)
+
+    if not args.dry_run:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            list(executor.map(lambda update: interactions.setInteractions(accounts_table, *update), updates))
+    logger.info("%s %d of %d accounts", "Would update" if args.dry_run else "Updated", len(updates), len(accounts))
+
+
+if __name__ == '__main__':
+    main()
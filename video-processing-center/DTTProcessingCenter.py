@@ -1,94 +1,222 @@
 import json
 import urllib.parse
-import boto3
 import os
 import logging
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
-import time
+from dtt_common import data, keys, metrics, renditions
 
 print("Loading function")
 
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
 
-s3 = boto3.client("s3")
-dyn = boto3.resource('dynamodb')
-videos_table = dyn.Table('dothethingvideos-metadata')
-accounts_table = dyn.Table('dothething-accounts')
+# ffmpeg reads uploads over presigned URLs that only need to outlive the ffmpeg run
+FFMPEG_URL_TTL = int(os.environ.get("FFMPEG_URL_TTL", "900"))
+FFMPEG_TIMEOUT = int(os.environ.get("FFMPEG_TIMEOUT", "120"))
 
-def lambda_handler(event, context):
-    print("Received event: " + json.dumps(event, indent = 2))
-    
-    # get the object from the event
-    bucket = event["Records"][0]["s3"]["bucket"]["name"]
-    key = urllib.parse.unquote_plus(event["Records"][0]["s3"]["object"]["key"], encoding="utf-8")
-    
-    # parse code from key
-    key_split = key.split("-")
-    code = key_split[0]
-    print("Code is:", code)
-    
-    # parse session_id from key
-    session_id = key_split[2].split(".")[0]
-    print("Session ID is", session_id)
+# uploads in one event are ingested concurrently, this many at a time (each runs an ffmpeg)
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "4"))
 
-    try:
-        # download video from S3
-        response = s3.get_object(Bucket=bucket, Key=key)
+# uploads larger than this, or whose Content-Type isn't a video (or the generic type S3
+# stores when the client sent none), are rejected before ffmpeg reads them
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(1024 * 1024 * 1024)))
+GENERIC_CONTENT_TYPES = ("", "binary/octet-stream", "application/octet-stream")
 
-        # write video to /tmp
-        os.chdir("/tmp")
-        tmp_file = key
-        with open(tmp_file, "wb") as f:
-            f.write(response["Body"].read())
+# every thumbnail rendition (dtt_common.renditions) of the frame at 1s of source (a path
+# or URL), from a single ffmpeg run
+def renditionsFromInput(source: str) -> dict:
+    with metrics.timer("ffmpeg"):
+        return renditions.extract(source, FFMPEG_TIMEOUT)
 
-        # get thumbnail of video
-        thumbnail = "".join([key, ".jpg"])
-        os.system("ffmpeg -i {} -ss 00:00:01.000 -vframes 1 {}".format(key, thumbnail))
+def extractRenditions(bucket: str, key: str) -> dict:
+    url = data.s3.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={
+            "Bucket": bucket,
+            "Key": key
+        },
+        ExpiresIn=FFMPEG_URL_TTL
+    )
+    return renditionsFromInput(url)
 
-        # upload thumbnail to S3
-        s3.upload_file(thumbnail, "dothethingthumbnails", thumbnail)
+def uploadRendition(key: str, name: str, image: bytes) -> None:
+    data.s3.put_object(
+        Bucket=data.THUMBNAILS_BUCKET,
+        Key=renditions.renditionKey(key, name),
+        Body=image,
+        ContentType=renditions.RENDITIONS_BY_NAME[name].content_type,
+        CacheControl="public, max-age=31536000, immutable"
+    )
 
-    except Exception as e:
-        print(e)
-        print("Error getting object {} from bucket {}. Make sure they exist and your bucket is in the same region as this function.".format(key, bucket))
-        raise e
-    
-    # query dothething-accounts to get account_id of the account with session_id
+# the upload's HEAD, or None if it no longer exists
+def headUpload(bucket: str, key: str):
     try:
-        # query on secondary index session_id
-        response = accounts_table.query(IndexName="sessionId-index", KeyConditionExpression="sessionId = :sessionId", ExpressionAttributeValues={":sessionId": session_id})
+        return data.s3.head_object(Bucket=bucket, Key=key)
     except ClientError as err:
+        if err.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
         logger.error(
-            "Couldn't query for account with session_id %s. Here's why: %s: %s", session_id,
+            "Couldn't get object %s from bucket %s. Here's why: %s: %s", key, bucket,
             err.response['Error']['Code'], err.response['Error']['Message'])
         raise
-    else:
-        if len(response['Items']) == 0:
-            print("No account found with session ID", session_id)
-            return
-            
-        account_id = response['Items'][0]['id']
-        print("Account ID is", account_id)
-
-        # get epoch time in milliseconds
-        epoch = int(time.time() * 1000)
-        print("Epoch is: " + str(epoch))
-
-        # add this object's metadata to DynamoDB (dothethingvideos-metadata)
+
+# why the upload can't be ingested, from its HEAD, or None if it can
+def rejectionReason(head) -> str:
+    if head is None:
+        return "it no longer exists"
+    if head['ContentLength'] == 0 or head['ContentLength'] > MAX_UPLOAD_BYTES:
+        return "its size of {} bytes is outside 1 to {}".format(head['ContentLength'], MAX_UPLOAD_BYTES)
+    content_type = head.get('ContentType', '').split(';')[0].strip().lower()
+    if content_type not in GENERIC_CONTENT_TYPES and not content_type.startswith('video/'):
+        return "its content type {} isn't a video".format(content_type)
+    return None
+
+# epoch time in milliseconds of an S3 event record ("eventTime": "2024-05-01T12:34:56.789Z"),
+# or None if it has none
+def eventEpoch(s3_record: dict):
+    if "eventTime" not in s3_record:
+        return None
+    event_time = datetime.strptime(s3_record["eventTime"], "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+    return int(event_time.timestamp() * 1000)
+
+# (bucket, key, event epoch or None, SQS message ID or None) for every upload in the event.
+# Records come either straight from S3 or as SQS messages whose body is an S3 event
+# notification.
+def uploadsFromEvent(event: dict) -> list:
+    uploads = []
+    for record in event.get("Records", []):
+        if record.get("eventSource") == "aws:sqs":
+            message_id = record["messageId"]
+            s3_records = json.loads(record["body"]).get("Records", [])
+        else:
+            message_id = None
+            s3_records = [record]
+        for s3_record in s3_records:
+            bucket = s3_record["s3"]["bucket"]["name"]
+            key = urllib.parse.unquote_plus(s3_record["s3"]["object"]["key"], encoding="utf-8")
+            uploads.append((bucket, key, eventEpoch(s3_record), message_id))
+    return uploads
+
+# account for every distinct session in the batch, each looked up once and concurrently;
+# a session whose lookup failed maps to the exception so only its uploads fail
+def resolveSessions(session_ids: set) -> dict:
+    def resolve(session_id):
+        try:
+            return data.resolveAccountId(session_id)
+        except Exception as e:
+            return e
+    session_ids = list(session_ids)
+    if len(session_ids) == 0:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(session_ids))) as executor:
+        return dict(zip(session_ids, executor.map(resolve, session_ids)))
+
+# Ingest runs in stages, cheapest first, and an upload rejected by one never reaches the
+# next: the key was parsed before (dtt_common.keys), then the account is resolved, the
+# object is checked with a HEAD, and only then does ffmpeg read it. Returns False if the
+# upload was rejected; rejections are final, so they aren't retried.
+def ingestUpload(bucket: str, key: str, event_epoch, upload_key: keys.UploadKey, account_id) -> bool:
+    logger.debug("Code is %s, session ID is %s", upload_key.code, upload_key.session_id)
+
+    if isinstance(account_id, Exception):
+        raise account_id
+    if account_id is None:
+        logger.warning("Rejected upload with code %s and upload ID %s: no account found for its session", upload_key.code, upload_key.upload_id)
+        return False
+    logger.debug("Account ID is %s", account_id)
+
+    head = headUpload(bucket, key)
+    reason = rejectionReason(head)
+    if reason is not None:
+        logger.warning("Rejected upload %s: %s", key, reason)
+        return False
+
+    try:
+        # extract the thumbnails straight from S3: ffmpeg reads the object over a presigned
+        # URL with ranged requests, so the video is never downloaded or written to /tmp
+        images = extractRenditions(bucket, key)
+
+        # upload thumbnails to S3
+        metrics.count("renditionBytes", sum(len(image) for image in images.values()))
+        with ThreadPoolExecutor(max_workers=len(images)) as executor:
+            list(executor.map(lambda name: uploadRendition(key, name, images[name]), images))
+
+    except Exception as e:
+        print(e)
+        print("Error getting object {} from bucket {}. Make sure they exist and your bucket is in the same region as this function.".format(key, bucket))
+        raise e
+
+    # the upload's time rather than now, so a retried ingest writes the same clip (see
+    # data.addVideo); epoch time in milliseconds. The event's eventTime is the same on every
+    # delivery and has millisecond precision; LastModified has whole seconds (and for a
+    # multipart upload is when it started), so clips in a code would often tie on it. It is
+    # only used for records without an eventTime.
+    epoch = event_epoch if event_epoch is not None else int(head['LastModified'].timestamp() * 1000)
+    print("Epoch is: " + str(epoch))
+
+    # add this object's metadata to DynamoDB (dothethingvideos-metadata), fan the clip out
+    # to the precomputed homefeeds (dothething-homefeed) and count it towards the
+    # interactions of every account whose feed it landed in
+    video = {
+        'code': upload_key.code,
+        'id': key,
+        'timeOfCreation': epoch,
+        'accountId': account_id,
+        'renditions': sorted(images)
+    }
+    if not data.addVideo(video):
+        print("Already ingested", key)
+    return True
+
+# Every upload in the batch is ingested, INGEST_WORKERS at a time, and one failing doesn't
+# stop the others. For SQS batches only the failed messages are reported back for retry
+# (the event source mapping needs ReportBatchItemFailures); for direct S3 invocations the
+# invocation fails if any upload did, and the retry re-ingests the whole event. Rejected
+# uploads (see ingestUpload) are logged and count as done.
+@metrics.instrument("processing")
+def lambda_handler(event, context):
+    logger.debug("Received event: %s", event)
+    metrics.setRoute("ingest")
+
+    records = uploadsFromEvent(event)
+    uploads = []
+    failed_messages = set()
+    failed_keys = []
+    rejected_keys = []
+    for bucket, key, event_epoch, message_id in records:
         try:
-            videos_table.put_item(
-                Item={
-                    'code': code,
-                    'id': key,
-                    'timeOfCreation': epoch,
-                    'accountId': account_id
-                }
-            )
-        except ClientError as err:
-            logger.error(
-                "Couldn't add video with id %s to table %s. Here's why: %s: %s",
-                key, videos_table.name,
-                err.response['Error']['Code'], err.response['Error']['Message'])
-            raise
-            
\ No newline at end of file
+            upload_key = keys.parseUploadKey(key)
+        except ValueError as e:
+            logger.warning("Rejected upload %s: %s", key, e)
+            rejected_keys.append(key)
+            continue
+        uploads.append((bucket, key, event_epoch, message_id, upload_key))
+
+    accounts = resolveSessions(set(upload[4].session_id for upload in uploads))
+
+    if len(uploads) > 0:
+        with ThreadPoolExecutor(max_workers=min(INGEST_WORKERS, len(uploads))) as executor:
+            futures = {
+                executor.submit(ingestUpload, bucket, key, event_epoch, upload_key, accounts[upload_key.session_id]): (key, message_id)
+                for bucket, key, event_epoch, message_id, upload_key in uploads
+            }
+            for future in as_completed(futures):
+                key, message_id = futures[future]
+                if future.exception() is not None:
+                    logger.error("Couldn't ingest %s: %s", key, future.exception())
+                    failed_keys.append(key)
+                    if message_id is not None:
+                        failed_messages.add(message_id)
+                elif not future.result():
+                    rejected_keys.append(key)
+
+    print("Ingested {} of {} uploads, {} rejected".format(len(records) - len(failed_keys) - len(rejected_keys), len(records), len(rejected_keys)))
+    metrics.count("uploads", len(records))
+    metrics.count("failedUploads", len(failed_keys))
+    metrics.count("rejectedUploads", len(rejected_keys))
+    if any(record.get("eventSource") == "aws:sqs" for record in event.get("Records", [])):
+        return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in sorted(failed_messages)]}
+    if len(failed_keys) > 0:
+        raise RuntimeError("Couldn't ingest {} of the uploads: {}".format(len(failed_keys), ", ".join(failed_keys)))